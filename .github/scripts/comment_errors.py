@@ -13,25 +13,51 @@
 # the start of a string ID is enough to find the file in that repository.
 
 from collections import defaultdict
-from reference_linter import outputErrors
+from http_client import HTTPClient
+from reference_linter import writeErrors
 import argparse
+import io
 import json
 import os
 import re
-import shutil
+import subprocess
 import sys
-import requests
-import urllib.request
 import zipfile
 
 
 class QueryPR:
-    def __init__(self, api_token):
+    def __init__(
+        self,
+        api_token,
+        api_url="https://api.github.com",
+        raw_url="https://raw.githubusercontent.com",
+        firefox_root=None,
+        blame_cache=None,
+    ):
         """Initialize object."""
 
         self.api_token = api_token
+        self.api_url = api_url.rstrip("/")
+        self.raw_url = raw_url.rstrip("/")
+        self.client = HTTPClient(api_token, self.api_url)
         self.owner = "mozilla-firefox"
         self.repository = "firefox"
+        self.line_indexes = {}
+        self.name_pattern = re.compile(r'name="([^"]*)"')
+        self.blame_header_pattern = re.compile(
+            r"^([0-9a-f]{40}) \d+ (\d+) (\d+)$", re.MULTILINE
+        )
+
+        # Sources of blame data, in order of preference. The API is used for
+        # files not available in the local checkout or the cache.
+        self.firefox_root = firefox_root
+        self.blame_cache = blame_cache
+        self.blame_sources = []
+        if blame_cache:
+            self.blame_sources.append(self.blame_from_cache)
+        if firefox_root:
+            self.blame_sources.append(self.blame_from_checkout)
+        self.blame_sources.append(self.blame_from_api)
 
     def set_pr_data(self, owner, repository, pr_number):
         self.pr_owner = owner
@@ -39,73 +65,58 @@ class QueryPR:
         self.pr_number = int(pr_number)
 
     def api_request(self, query):
-        url = "https://api.github.com/graphql"
+        url = f"{self.api_url}/graphql"
         json_query = {"query": query}
-        headers = {"Authorization": f"token {self.api_token}"}
-        r = requests.post(url=url, json=json_query, headers=headers)
+        r = self.client.post(url, json=json_query)
 
         return r.json()
 
     def extract_errors_artifact(self, run_id):
-        url = f"https://api.github.com/repos/{self.pr_owner}/{self.pr_repository}/actions/artifacts"
-        headers = {"Authorization": f"token {self.api_token}"}
-        r = requests.get(url=url, headers=headers)
+        url = f"{self.api_url}/repos/{self.pr_owner}/{self.pr_repository}/actions/runs/{run_id}/artifacts"
+        r = self.client.get(url)
         try:
             json_data = r.json()["artifacts"]
         except Exception:
             return {}
 
         errors = {}
+        # Each run only has one artifact
         file_url = None
         for artifact in json_data:
-            # Each run only has one artifact
-            if str(artifact["workflow_run"]["id"]) == run_id:
+            if not artifact.get("expired"):
                 file_url = artifact["archive_download_url"]
+                break
 
         if file_url:
-            tmp_folder = "tmp_artifacts"
-            os.makedirs(tmp_folder, exist_ok=True)
-            local_artifact_path = os.path.join(tmp_folder, "errors.zip")
-            # Save artifact as errors.zip
-            with requests.get(url=file_url, headers=headers, stream=True) as response:
-                with open(local_artifact_path, "wb") as f:
-                    shutil.copyfileobj(response.raw, f)
-
-            if not os.path.exists(local_artifact_path):
-                print(
-                    f"There was an error downloading the artifact: {local_artifact_path}"
-                )
+            response = self.client.get(file_url)
+            if not response.ok:
+                print(f"There was an error downloading the artifact: {file_url}")
                 return errors
 
-            # Extract the ZIP file in a temporary folder
-            with zipfile.ZipFile(local_artifact_path, "r") as z:
-                z.extractall(tmp_folder)
-
-            json_path = os.path.join(tmp_folder, "errors.json")
-            if os.path.exists(json_path):
-                with open(json_path, "r") as f:
-                    errors = json.load(f)
-
-            # Remove the temporary folder
-            shutil.rmtree(tmp_folder)
+            # Read errors.json directly from the ZIP file in memory
+            with zipfile.ZipFile(io.BytesIO(response.content)) as z:
+                if "errors.json" in z.namelist():
+                    errors = json.loads(z.read("errors.json"))
 
         return errors
 
     def get_authors(self, errors):
         # Get the full list of authors based on the errors
-        self.authors = []
+        string_ids = defaultdict(set)
         for config_name, config_errors in errors.items():
-            for filepath, string_ids in config_errors.items():
-                self.lines = []
+            for filepath, ids in config_errors.items():
                 # Need to manually change the path to match the firefox
                 # repository
                 filepath = filepath.removeprefix("mozilla-mobile/")
-                filepath = f"mobile/android/{filepath}"
-                for string_id in string_ids:
-                    n = self.find_string_line(filepath, string_id)
-                    self.lines.append(n)
-                self.lines.sort()
-                self.find_lines_author(filepath)
+                string_ids[f"mobile/android/{filepath}"].update(ids)
+
+        # Download and index files in parallel
+        self.client.map(self.get_line_index, string_ids)
+        lines = {
+            filepath: self.find_string_lines(filepath, ids)
+            for filepath, ids in string_ids.items()
+        }
+        self.authors = self.find_lines_authors(lines)
         self.authors.sort()
 
         print(f"Authors: {', '.join(self.authors)}")
@@ -118,20 +129,211 @@ class QueryPR:
 
         return self.authors
 
-    def find_string_line(self, filepath, string_id):
-        # Find the line number where the string ID is defined
+    def find_string_lines(self, filepath, string_ids):
+        # Find the line numbers where the string IDs are defined
+
+        line_index = self.get_line_index(filepath)
+
+        return sorted(
+            line_index[string_id] for string_id in string_ids if string_id in line_index
+        )
+
+    def get_line_index(self, filepath):
+        # Return a map from string ID to line number, downloading and indexing
+        # each file only once
         # In the XML, strings are defined as name="ID"
 
-        url = f"https://raw.githubusercontent.com/{self.owner}/{self.repository}/main/{filepath}"
-        data = urllib.request.urlopen(url)
-        for n, line in enumerate(data):
-            if f'name="{string_id}"' in line.decode("utf-8"):
-                return n + 1
+        if filepath in self.line_indexes:
+            return self.line_indexes[filepath]
+
+        local_path = (
+            os.path.join(self.firefox_root, filepath) if self.firefox_root else None
+        )
+        if local_path and os.path.isfile(local_path):
+            with open(local_path, "r", encoding="utf-8") as f:
+                content = f.read()
+        else:
+            url = f"{self.raw_url}/{self.owner}/{self.repository}/main/{filepath}"
+            response = self.client.get(url)
+            if not response.ok:
+                print(f"Error downloading {filepath}: {response.status_code}")
+                self.line_indexes[filepath] = {}
+                return {}
+            content = response.content.decode("utf-8")
+        line_index = {}
+        line = 1
+        pos = 0
+        for match in self.name_pattern.finditer(content):
+            line += content.count("\n", pos, match.start())
+            pos = match.start()
+            line_index.setdefault(match.group(1), line)
+        self.line_indexes[filepath] = line_index
+
+        return line_index
+
+    def find_lines_authors(self, lines):
+        # Blame each file with the first source that has data for it, then
+        # identify the authors for the line numbers in each file
+
+        lines = {filepath: sorted(n) for filepath, n in lines.items() if n}
+        ranges = {}
+        for blame_source in self.blame_sources:
+            missing = {
+                filepath: n for filepath, n in lines.items() if filepath not in ranges
+            }
+            if not missing:
+                break
+            ranges.update(blame_source(missing))
+
+        authors = []
+        for filepath in sorted(lines):
+            if filepath not in ranges:
+                print(f"Blame not available for {filepath}")
+                continue
+            file_ranges = ranges[filepath]
+            range_index = 0
+            for line in lines[filepath]:
+                # Ranges are sorted, find the one including this line
+                while (
+                    range_index < len(file_ranges)
+                    and file_ranges[range_index]["endingLine"] < line
+                ):
+                    range_index += 1
+                if range_index == len(file_ranges):
+                    break
+                author = file_ranges[range_index]["login"]
+                if author and author not in authors:
+                    authors.append(author)
+
+        return authors
+
+    def blame_from_cache(self, lines):
+        # Read blame ranges from a precomputed JSON file, with the list of
+        # ranges for each file, e.g.
+        # {"path": [{"startingLine": 1, "endingLine": 3, "login": "user"}]}
+
+        try:
+            with open(self.blame_cache, "r") as f:
+                cached_ranges = json.load(f)
+        except Exception as e:
+            print(f"Error reading blame cache: {e}")
+            return {}
+
+        return {
+            filepath: sorted(cached_ranges[filepath], key=lambda r: r["startingLine"])
+            for filepath in lines
+            if filepath in cached_ranges
+        }
+
+    def blame_from_checkout(self, lines):
+        # Blame files in a local checkout of the code repository, then use
+        # GraphQL to find the authors of the commits with a single query
+
+        def blame_file(filepath):
+            try:
+                output = subprocess.run(
+                    ["git", "blame", "--porcelain", "--", filepath],
+                    cwd=self.firefox_root,
+                    capture_output=True,
+                    check=True,
+                    text=True,
+                ).stdout
+            except (OSError, subprocess.CalledProcessError) as e:
+                print(f"Error running git blame on {filepath}: {e}")
+                return None
+
+            # Each group of lines starts with a header, e.g.
+            # "<sha> <original line> <final line> <number of lines>"
+            file_ranges = []
+            for header in self.blame_header_pattern.finditer(output):
+                sha, start, count = header.groups()
+                start = int(start)
+                file_ranges.append(
+                    {
+                        "startingLine": start,
+                        "endingLine": start + int(count) - 1,
+                        "sha": sha,
+                    }
+                )
+
+            return file_ranges
+
+        filepaths = sorted(lines)
+        ranges = {}
+        for filepath, file_ranges in zip(
+            filepaths, self.client.map(blame_file, filepaths)
+        ):
+            if file_ranges is not None:
+                ranges[filepath] = file_ranges
+
+        # Only look up the commits for the lines that need an author
+        commits = set()
+        for filepath, file_ranges in ranges.items():
+            for line in lines[filepath]:
+                for file_range in file_ranges:
+                    if file_range["startingLine"] <= line <= file_range["endingLine"]:
+                        commits.add(file_range["sha"])
+                        break
+        logins = self.find_commits_authors(sorted(commits))
+        for file_ranges in ranges.values():
+            for file_range in file_ranges:
+                file_range["login"] = logins.get(file_range["sha"])
+
+        return ranges
+
+    def find_commits_authors(self, commits):
+        # Use GraphQL to find the GitHub user for each commit, with an alias
+        # for each commit in the query
+
+        query = """
+            {
+            repository(owner: "%OWNER%", name: "%REPO%") {
+                %COMMITS%
+            }
+            }
+        """
+        commit_query = """
+                %ALIAS%: object(oid: "%OID%") {
+                    ... on Commit {
+                    author {
+                        user {
+                        login
+                        }
+                    }
+                    }
+                }
+        """
+
+        logins = {}
+        batch_size = 100
+        for batch_start in range(0, len(commits), batch_size):
+            aliases = {
+                f"commit{n}": sha
+                for n, sha in enumerate(commits[batch_start : batch_start + batch_size])
+            }
+            batch_query = (
+                query.replace("%OWNER%", self.owner)
+                .replace("%REPO%", self.repository)
+                .replace(
+                    "%COMMITS%",
+                    "".join(
+                        commit_query.replace("%ALIAS%", alias).replace("%OID%", sha)
+                        for alias, sha in aliases.items()
+                    ),
+                )
+            )
+            r = self.api_request(batch_query)
+            repository = (r.get("data") or {}).get("repository") or {}
+            for alias, sha in aliases.items():
+                try:
+                    logins[sha] = repository[alias]["author"]["user"]["login"]
+                except Exception:
+                    logins[sha] = None
 
-        return 0
+        return logins
 
-    def find_lines_author(self, filepath):
-        # Use GraphQL to blame the file and identify the author for a specific line number
+    def blame_from_api(self, lines):
+        # Use GraphQL to blame files, with an alias for each file in the query
 
         query = """
             {
@@ -139,7 +341,15 @@ class QueryPR:
                 ref(qualifiedName: "main") {
                 target {
                     ... on Commit {
-                    blame(path: "%PATH%") {
+                    %BLAME%
+                    }
+                }
+                }
+            }
+            }
+        """
+        blame_query = """
+                    %ALIAS%: blame(path: "%PATH%") {
                         ranges {
                         commit {
                             author {
@@ -152,35 +362,57 @@ class QueryPR:
                         endingLine
                         }
                     }
-                    }
-                }
-                }
-            }
-            }
         """
-        filepath = filepath.lstrip("/")
-        query = (
-            query.replace("%OWNER%", self.owner)
-            .replace("%REPO%", self.repository)
-            .replace("%PATH%", filepath)
-        )
-
-        r = self.api_request(query)
 
-        ranges = r["data"]["repository"]["ref"]["target"]["blame"]["ranges"]
+        # Each file needs its own alias in the query. Blaming large files is
+        # expensive, so files are queried in small batches to stay within
+        # GraphQL limits. Files in a failed batch have no blame available.
+        filepaths = sorted(lines)
+        ranges = {}
+        batch_size = 10
+        for batch_start in range(0, len(filepaths), batch_size):
+            aliases = {
+                f"file{n}": filepath
+                for n, filepath in enumerate(
+                    filepaths[batch_start : batch_start + batch_size]
+                )
+            }
+            batch_query = (
+                query.replace("%OWNER%", self.owner)
+                .replace("%REPO%", self.repository)
+                .replace(
+                    "%BLAME%",
+                    "".join(
+                        blame_query.replace("%ALIAS%", alias).replace(
+                            "%PATH%", filepath.lstrip("/")
+                        )
+                        for alias, filepath in aliases.items()
+                    ),
+                )
+            )
+            try:
+                r = self.api_request(batch_query)
+                target = r["data"]["repository"]["ref"]["target"] or {}
+            except Exception:
+                continue
+            for alias, filepath in aliases.items():
+                if not target.get(alias):
+                    continue
+                ranges[filepath] = []
+                for blame_range in target[alias]["ranges"]:
+                    try:
+                        login = blame_range["commit"]["author"]["user"]["login"]
+                    except Exception:
+                        login = None
+                    ranges[filepath].append(
+                        {
+                            "startingLine": blame_range["startingLine"],
+                            "endingLine": blame_range["endingLine"],
+                            "login": login,
+                        }
+                    )
 
-        current_line_index = 0
-        for range in ranges:
-            if self.lines[current_line_index] <= range["endingLine"]:
-                try:
-                    author = range["commit"]["author"]["user"]["login"]
-                except Exception:
-                    author = None
-                if author and author not in self.authors:
-                    self.authors.append(author)
-                current_line_index += 1
-                if current_line_index >= len(self.lines):
-                    return
+        return ranges
 
     def query_comments(self, order="first", size=100):
         # Query comments, either first or last
@@ -268,11 +500,14 @@ class QueryPR:
                         )
                         if error not in reported_errors_id:
                             if id in missing_errors[config_name][filename]:
-                                missing_errors[config_name][filename].append(error)
+                                missing_errors[config_name][filename][id][
+                                    "errors"
+                                ].append(error)
                             else:
                                 missing_errors[config_name][filename][id] = {
                                     "errors": [error],
-                                    "text": file_data["text"],
+                                    "value": file_data["value"],
+                                    "comment": file_data.get("comment", ""),
                                 }
 
         return missing_errors
@@ -303,6 +538,37 @@ def main():
         dest="dest_file",
         help="Path to dest file with comment content",
     )
+    parser.add_argument(
+        "--api-url",
+        default="https://api.github.com",
+        dest="api_url",
+        help="Base URL of the GitHub API",
+    )
+    parser.add_argument(
+        "--raw-url",
+        default="https://raw.githubusercontent.com",
+        dest="raw_url",
+        help="Base URL used to download files from the code repository",
+    )
+    parser.add_argument(
+        "--max-size",
+        default=65536,
+        type=int,
+        dest="max_size",
+        help="Maximum size of the comment in characters (errors exceeding it are "
+        "only counted)",
+    )
+    parser.add_argument(
+        "--firefox",
+        dest="firefox_root",
+        help="Path to a local checkout of the Firefox repository, used to find "
+        "and blame strings without downloading files",
+    )
+    parser.add_argument(
+        "--blame-cache",
+        dest="blame_cache",
+        help="Path to JSON file with precomputed blame ranges for each file",
+    )
     args = parser.parse_args()
 
     if not os.path.isfile(args.json_file):
@@ -314,24 +580,29 @@ def main():
         print("No errors found.")
         sys.exit(0)
 
-    query_pr = QueryPR(args.token)
+    query_pr = QueryPR(
+        args.token, args.api_url, args.raw_url, args.firefox_root, args.blame_cache
+    )
     query_pr.set_pr_data(args.owner, args.repo, args.pr_number)
     authors = query_pr.get_authors(errors)
     missing_errors = query_pr.exclude_reported_errors(errors)
 
-    output = []
-    if authors:
-        line = "Authors: "
-        for author in authors:
-            line = f"{line} @{author}"
-        output.append(f"{line}\n")
-
-    output += outputErrors(missing_errors)
-
-    if output:
-        output.insert(0, f"Run ID: {args.run_id}\n")
+    has_errors = any(
+        file_data["errors"]
+        for config_errors in missing_errors.values()
+        for ids in config_errors.values()
+        for file_data in ids.values()
+    )
+    if authors or has_errors:
+        header = f"Run ID: {args.run_id}\n"
+        if authors:
+            line = "Authors: "
+            for author in authors:
+                line = f"{line} @{author}"
+            header += f"{line}\n"
         with open(args.dest_file, "w") as f:
-            f.writelines(output)
+            f.write(header)
+            writeErrors(missing_errors, f, max_size=args.max_size - len(header))
     else:
         print("All errors are already reported")
 
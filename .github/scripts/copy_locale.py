@@ -4,55 +4,241 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+# This script copies localized files from a source locale to a destination
+# locale. Aliases can be defined in a JSON file as a list of objects, e.g.
+#
+#   [{"locale": "es", "source": "es-ES", "mode": "copy"}]
+#
+# With the `copy` mode, files of the destination locale are copies of the
+# source files. With `fill`, only messages missing in the destination files are
+# added from the source locale. Aliases are processed in order, so an alias can
+# use the files updated by a previous one as source.
+
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
+from functions import write_file, write_resource
+from moz.l10n.paths import L10nConfigPaths, get_android_locale
+from moz.l10n.resource import add_entries, parse_resource
 import argparse
+import fcntl
+import filecmp
+import json
 import os
 import shutil
 import sys
 
+# ioctl request to clone a file's content (reflink) on Linux
+FICLONE = 0x40049409
+
+
+def get_toml_files(project_config_paths, source_locale, dest_locale):
+    """
+    Return (source, destination) file pairs for the paths listed in a project
+    configuration (TOML).
+    """
+
+    files = []
+    for (ref_path, tgt_path), locales in project_config_paths.all().items():
+        src_filename = project_config_paths.format_target_path(tgt_path, source_locale)
+        if os.path.isfile(src_filename):
+            files.append(
+                (
+                    src_filename,
+                    project_config_paths.format_target_path(tgt_path, dest_locale),
+                )
+            )
+
+    return files
+
+
+def get_glob_files(base_path, source_locale, dest_locale):
+    """
+    Return (source, destination) file pairs for all the files of the source
+    locale in base_path.
+    """
+
+    source_folder = f"values-{source_locale.replace('-', '-r')}"
+    dest_folder = f"values-{dest_locale.replace('-', '-r')}"
+
+    return [
+        (xml_path, xml_path.replace(f"{source_folder}", f"{dest_folder}"))
+        for xml_path in glob(f"{base_path}/**/{source_folder}/*.xml", recursive=True)
+    ]
+
+
+def copy_file(src_filename, dest_filename, link="copy"):
+    """
+    Copy a file unless the destination already has the same content, and
+    return True if it was copied.
+
+    With `hardlink`, the destination is linked to the source file. With
+    `reflink`, the content is cloned on filesystems that support it (and
+    copied otherwise).
+    """
+
+    os.makedirs(os.path.dirname(dest_filename), exist_ok=True)
+    if link == "copy":
+        with open(src_filename, "rb") as f:
+            return write_file(dest_filename, f.read())
+
+    # Compare the content, as files from a fresh checkout can have the same
+    # size and modification time even if they're different.
+    if os.path.isfile(dest_filename) and filecmp.cmp(
+        src_filename, dest_filename, shallow=False
+    ):
+        return False
+
+    tmp_filename = f"{dest_filename}.tmp"
+    try:
+        if link == "hardlink":
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            os.link(src_filename, tmp_filename)
+        else:
+            with open(src_filename, "rb") as src, open(tmp_filename, "wb") as dest:
+                try:
+                    fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+                except OSError:
+                    shutil.copyfileobj(src, dest)
+            shutil.copystat(src_filename, tmp_filename)
+        os.replace(tmp_filename, dest_filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+    return True
+
+
+def get_resource(filename, resources):
+    """Parse a resource, reusing it if the file was already parsed."""
+
+    if filename not in resources:
+        with open(filename, "rb") as f:
+            resources[filename] = parse_resource(filename, f.read())
+
+    return resources[filename]
+
+
+def fill_file(src_filename, dest_filename, resources):
+    """
+    Add the messages missing in the destination file from the source file,
+    and return True if the destination file was changed.
+    """
+
+    if not os.path.isfile(dest_filename):
+        resources.pop(dest_filename, None)
+        return copy_file(src_filename, dest_filename)
+
+    src_res = get_resource(src_filename, resources)
+    dest_res = get_resource(dest_filename, resources)
+    if not add_entries(dest_res, src_res):
+        return False
+
+    return write_resource(dest_filename, dest_res)
+
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--source",
-        required=True,
         dest="source_locale",
         help="Locale code to use as source",
     )
     parser.add_argument(
         "--dest",
-        required=True,
         dest="dest_locale",
         help="Locale code to use as destination",
     )
     parser.add_argument(
+        "--aliases",
+        dest="aliases_file",
+        help="Path to JSON file with the list of aliases to process, instead of "
+        "--source and --dest",
+    )
+    paths_group = parser.add_mutually_exclusive_group(required=True)
+    paths_group.add_argument(
         "--path",
-        required=True,
         dest="base_path",
         help="Path to the base folder including localized files",
     )
+    paths_group.add_argument(
+        "--toml",
+        dest="toml_paths",
+        nargs="+",
+        help="Path to l10n.toml files, to only copy the files they list",
+    )
+    parser.add_argument(
+        "--link",
+        choices=["copy", "hardlink", "reflink"],
+        default="copy",
+        help="How to create the destination files (default: copy). Hard links "
+        "share content with the source, so files must be replaced, not edited "
+        "in place",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=8,
+        help="Number of files copied in parallel (default: 8)",
+    )
     parser.add_argument("locales", nargs="*", help="Locales to process")
     args = parser.parse_args()
 
-    # Set variables from args
-    base_path = args.base_path
-    source_locale = args.source_locale
-    source_folder = f"values-{source_locale.replace('-', '-r')}"
-    dest_locale = args.dest_locale
-    dest_folder = f"values-{dest_locale.replace('-', '-r')}"
+    if args.aliases_file:
+        try:
+            with open(args.aliases_file) as f:
+                aliases = json.load(f)
+        except Exception as e:
+            sys.exit(e)
+    elif args.source_locale and args.dest_locale:
+        aliases = [
+            {"locale": args.dest_locale, "source": args.source_locale, "mode": "copy"}
+        ]
+    else:
+        sys.exit("Either --aliases, or --source and --dest, must be provided.")
+
+    project_configs = [
+        L10nConfigPaths(toml_path, locale_map={"android_locale": get_android_locale})
+        for toml_path in args.toml_paths or []
+    ]
+    # Parsed resources, shared by all aliases so that each file is parsed once
+    resources = {}
+    for alias in aliases:
+        source_locale = alias["source"]
+        dest_locale = alias["locale"]
+        mode = alias.get("mode", "copy")
+        if mode not in ("copy", "fill"):
+            sys.exit(f"Unknown mode for {dest_locale}: {mode}")
+
+        # Get a list of all the files for the source locale
+        if project_configs:
+            files = []
+            for project_config_paths in project_configs:
+                files += get_toml_files(
+                    project_config_paths, source_locale, dest_locale
+                )
+            source_path = ", ".join(args.toml_paths)
+        else:
+            files = get_glob_files(args.base_path, source_locale, dest_locale)
+            source_path = os.path.join(args.base_path, source_locale)
+        if not files:
+            sys.exit(f"No reference file found in {source_path}")
+
+        # Copy the files to the destination locale
+        def process_file(file):
+            src_filename, dest_filename = file
+            if mode == "fill":
+                return fill_file(src_filename, dest_filename, resources)
+            resources.pop(dest_filename, None)
+            return copy_file(src_filename, dest_filename, args.link)
 
-    # Get a list of all the files for the source locale
-    source_files = []
-    for xml_path in glob(f"{base_path}/**/{source_folder}/*.xml", recursive=True):
-        source_files.append(xml_path)
-    if not source_files:
-        sys.exit(f"No reference file found in {os.path.join(base_path, source_locale)}")
-
-    # Copy the files to the destination locale
-    for src_filename in source_files:
-        dest_filename = src_filename.replace(f"{source_folder}", f"{dest_folder}")
-        os.makedirs(os.path.dirname(dest_filename), exist_ok=True)
-        shutil.copy(src_filename, dest_filename)
+        with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as executor:
+            updated = sum(executor.map(process_file, files))
+        print(
+            f"{dest_locale} ({mode} from {source_locale}): updated {updated} files "
+            f"({len(files) - updated} unchanged)."
+        )
 
 
 if __name__ == "__main__":
@@ -12,9 +12,14 @@
 # with return value 1.
 
 from collections import defaultdict
-from reference_linter import StringExtraction, mergeErrors, outputErrors
+from functions import StringIndex
+from reference_linter import (
+    StringExtraction,
+    getChangedFiles,
+    saveErrors,
+    writeErrors,
+)
 import argparse
-import json
 import os
 import sys
 
@@ -36,8 +41,9 @@ def main():
     parser.add_argument(
         "--toml",
         required=True,
-        dest="toml_path",
-        help="Path to l10n.toml file, relative to the root of the project folder",
+        dest="toml_paths",
+        nargs="+",
+        help="Path to l10n.toml files, relative to the root of the project folder",
     )
     parser.add_argument(
         "--json",
@@ -45,6 +51,11 @@ def main():
         dest="json_file",
         help="Save error info as JSON to file",
     )
+    parser.add_argument(
+        "--index",
+        dest="index_file",
+        help="Path to SQLite file used to store and reuse parsed strings",
+    )
     args = parser.parse_args()
 
     def normalize_keys(strings, root_path):
@@ -56,60 +67,73 @@ def main():
             normalized[f"{rel_path}:{string_id}"] = value
         return normalized
 
-    toml_path = args.toml_path
-    base = StringExtraction(os.path.join(args.base_path, toml_path))
-    base.extractStrings()
-    base_strings = normalize_keys(base.getTranslations(), args.base_path)
-
-    head = StringExtraction(os.path.join(args.head_path, toml_path))
-    head.extractStrings()
-    head_strings = normalize_keys(head.getTranslations(), args.head_path)
-
-    # Find differences
-    errors = {
-        key: {"previous": base_strings[key], "new": head_strings[key]}
-        for key in base_strings.keys()
-        if key in head_strings
-        and base_strings[key]["value"] != head_strings[key]["value"]
-    }
-
-    errors_json = {toml_path: defaultdict(dict)}
-    for string_id in errors.keys():
-        filename, id = string_id.split(":")
-        error_msg = f"String was changed without a new ID. Previous value: `{errors[string_id]['previous']['value']}`"
-        if id in errors_json[toml_path].get(filename, {}):
-            errors_json[toml_path][filename]["errors"][id].append(error_msg)
-        else:
-            errors_json[toml_path][filename][id] = {
-                "errors": [error_msg],
-                "value": errors[string_id]["new"]["value"],
-                "comment": errors[string_id]["new"].get("comment", ""),
-            }
+    index = StringIndex(args.index_file) if args.index_file else None
+    base_files_parsed = {}
+    head_files_parsed = {}
+    errors_json = {}
+    for toml_path in args.toml_paths:
+        base = StringExtraction(
+            os.path.join(args.base_path, toml_path), index, base_files_parsed
+        )
+        head = StringExtraction(
+            os.path.join(args.head_path, toml_path), index, head_files_parsed
+        )
+
+        # Only reference files present in both versions with different content
+        # can include changed strings, so there's no need to parse the others.
+        base_files = {
+            os.path.relpath(f, args.base_path) for f in base.getReferenceFiles()
+        }
+        changed_files = [
+            os.path.relpath(f, args.head_path)
+            for f in getChangedFiles(
+                head.getReferenceFiles(), args.base_path, args.head_path
+            )
+        ]
+        changed_files = [f for f in changed_files if f in base_files]
+        print(f"Changed reference files ({toml_path}): {len(changed_files)}")
+
+        base.extractStrings([os.path.join(args.base_path, f) for f in changed_files])
+        base_strings = normalize_keys(base.getTranslations(), args.base_path)
+
+        head.extractStrings([os.path.join(args.head_path, f) for f in changed_files])
+        head_strings = normalize_keys(head.getTranslations(), args.head_path)
+
+        # Find differences
+        errors = {
+            key: {"previous": base_strings[key], "new": head_strings[key]}
+            for key in base_strings.keys()
+            if key in head_strings
+            and base_strings[key]["value"] != head_strings[key]["value"]
+        }
+
+        errors_json[toml_path] = defaultdict(dict)
+        for string_id in errors.keys():
+            filename, id = string_id.split(":")
+            error_msg = f"String was changed without a new ID. Previous value: `{errors[string_id]['previous']['value']}`"
+            if id in errors_json[toml_path].get(filename, {}):
+                errors_json[toml_path][filename]["errors"][id].append(error_msg)
+            else:
+                errors_json[toml_path][filename][id] = {
+                    "errors": [error_msg],
+                    "value": errors[string_id]["new"]["value"],
+                    "comment": errors[string_id]["new"].get("comment", ""),
+                }
+    if index:
+        index.close()
 
     has_errors = False
     for config_name, config_errors in errors_json.items():
         if config_errors:
             has_errors = True
     if has_errors:
-        output = outputErrors(errors_json)
-        print(output)
+        writeErrors(errors_json, sys.stdout)
+        print()
 
         # Check if there's a JSON output specified
         json_file = args.json_file
         if json_file:
-            print(f"Saving output to {json_file}")
-            if os.path.exists(json_file):
-                try:
-                    with open(json_file, "r") as f:
-                        previous_content = json.load(f)
-                except Exception:
-                    previous_content = {}
-            else:
-                previous_content = {}
-
-            merged_content = mergeErrors(errors_json, previous_content)
-            with open(json_file, "w") as f:
-                json.dump(merged_content, f, indent=2, sort_keys=True)
+            saveErrors(errors_json, json_file)
         else:
             # Exit with status 1
             sys.exit(1)
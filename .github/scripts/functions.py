@@ -1,22 +1,96 @@
+from fnmatch import translate
+from functools import lru_cache
+from hashlib import sha256
 from html import unescape
 from html.parser import HTMLParser
+from os import chmod, fdopen, replace, umask, unlink
+from os.path import abspath, basename, dirname
+from shutil import copymode
+from tempfile import mkstemp
 from typing import Union
+import re
+import sqlite3
+import threading
 from moz.l10n.message import serialize_message
-from moz.l10n.resource import parse_resource
+from moz.l10n.resource import parse_resource, serialize_resource
 from moz.l10n.model import (
     CatchallKey,
     Entry,
     Message,
     PatternMessage,
+    Resource,
     SelectMessage,
 )
 
 
-def parse_file(
-    filename: str,
-    storage: dict[str, dict[str, str]],
-    id_base: str,
-) -> None:
+def file_hash(filename: str) -> str:
+    """Return the SHA-256 hex digest of the file's content."""
+
+    with open(filename, "rb") as f:
+        return sha256(f.read()).hexdigest()
+
+
+# The process umask, read once at import: changing it while other threads
+# create files would give them the wrong permissions.
+UMASK = umask(0)
+umask(UMASK)
+
+
+def write_file(filename: str, data: bytes) -> bool:
+    """
+    Write `data` to `filename`, unless the file already has the same content.
+
+    The data is first written to a temporary file which then replaces
+    the original, so an interrupted write never leaves a partial file.
+    Returns True if the file was written.
+    """
+
+    try:
+        with open(filename, "rb") as f:
+            if f.read() == data:
+                return False
+        mode = None
+    except FileNotFoundError:
+        mode = 0o666 & ~UMASK
+
+    fd, tmp_path = mkstemp(
+        dir=dirname(filename) or ".", prefix=f".{basename(filename)}.", suffix=".tmp"
+    )
+    try:
+        with fdopen(fd, "wb") as f:
+            f.write(data)
+        if mode is None:
+            copymode(filename, tmp_path)
+        else:
+            chmod(tmp_path, mode)
+        replace(tmp_path, filename)
+    except BaseException:
+        unlink(tmp_path)
+        raise
+    return True
+
+
+def write_resource(filename: str, resource: Resource) -> bool:
+    """
+    Serialize `resource` and write it to `filename` with `write_file()`.
+
+    Returns True if the file was written.
+    """
+
+    data = "".join(serialize_resource(resource)).encode("utf-8")
+    return write_file(filename, data)
+
+
+TOOLS_IGNORE = "{http://schemas.android.com/tools}ignore"
+
+
+def extract_entries(filename: str) -> list[dict[str, str]]:
+    """
+    Parse an Android resource file and return its entries in order, each with
+    its ID, kind ("string", "plurals" or "array"), value, comment, and the
+    value of its `tools:ignore` attribute.
+    """
+
     def get_entry_value(value: Message) -> str:
         entry_value = serialize_message(resource.format, value)
         # Unescape literal quotes
@@ -36,28 +110,190 @@ def parse_file(
             )
         return "\n".join(lines)
 
+    resource = parse_resource(filename, android_literal_quotes=True)
+
+    entries: list[dict[str, str]] = []
+    for section in resource.sections:
+        for entry in section.entries:
+            if isinstance(entry, Entry):
+                # If it's a plural string in Android, each variant
+                # is stored within the message, following a format
+                # similar to Fluent.
+                if hasattr(entry.value, "variants"):
+                    kind = "plurals"
+                    value = serialize_select_variants(entry)
+                else:
+                    kind = "array" if len(entry.id) > 1 else "string"
+                    value = get_entry_value(entry.value)
+                entries.append(
+                    {
+                        "id": ".".join(section.id + entry.id),
+                        "kind": kind,
+                        "value": value,
+                        "comment": entry.comment,
+                        "ignore": next(
+                            (m.value for m in entry.meta if m.key == TOOLS_IGNORE), ""
+                        ),
+                    }
+                )
+    return entries
+
+
+class StringIndex:
+    """
+    Persistent index of the entries extracted from reference files, stored
+    as an SQLite database and keyed by file path and content hash.
+
+    Files with the same content share their entries, and only the files
+    that are new or changed since the index was last used are parsed again.
+    """
+
+    fields = ("id", "kind", "value", "comment", "ignore")
+
+    def __init__(self, db_path: str):
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, hash TEXT);
+            CREATE TABLE IF NOT EXISTS resources (hash TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS strings (
+                hash TEXT, position INTEGER,
+                id TEXT, kind TEXT, value TEXT, comment TEXT, ignore TEXT
+            );
+            CREATE INDEX IF NOT EXISTS strings_hash ON strings (hash);
+            """)
+        self.hashes: dict[str, str] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, filename: str) -> list[dict[str, str]] | None:
+        """Return the indexed entries of the file, or None if its content is not indexed."""
+
+        path = abspath(filename)
+        hash = self.hashes[path] = file_hash(filename)
+        self.db.execute(
+            "INSERT OR REPLACE INTO files (path, hash) VALUES (?, ?)", (path, hash)
+        )
+        if not self.db.execute(
+            "SELECT 1 FROM resources WHERE hash = ?", (hash,)
+        ).fetchone():
+            return None
+        rows = self.db.execute(
+            f"SELECT {', '.join(self.fields)} FROM strings WHERE hash = ? ORDER BY position",
+            (hash,),
+        )
+        return [dict(zip(self.fields, row)) for row in rows]
+
+    def put(self, filename: str, entries: list[dict[str, str]]) -> None:
+        """Store the entries of the file, as returned by `extract_entries()`."""
+
+        path = abspath(filename)
+        hash = self.hashes.get(path) or file_hash(filename)
+        self.db.execute(
+            "INSERT OR REPLACE INTO files (path, hash) VALUES (?, ?)", (path, hash)
+        )
+        self.db.execute("INSERT OR IGNORE INTO resources (hash) VALUES (?)", (hash,))
+        self.db.execute("DELETE FROM strings WHERE hash = ?", (hash,))
+        self.db.executemany(
+            f"INSERT INTO strings (hash, position, {', '.join(self.fields)}) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (hash, position, *(entry[field] for field in self.fields))
+                for position, entry in enumerate(entries)
+            ],
+        )
+
+    def close(self) -> None:
+        """Drop the entries no longer used by any file, and save the index."""
+
+        self.db.execute(
+            "DELETE FROM resources WHERE hash NOT IN (SELECT hash FROM files)"
+        )
+        self.db.execute(
+            "DELETE FROM strings WHERE hash NOT IN (SELECT hash FROM resources)"
+        )
+        self.db.commit()
+        self.db.close()
+
+
+class ExceptionIndex:
+    """
+    Linter exceptions indexed by category, so that looking up a string ID
+    doesn't depend on the number of exceptions.
+
+    An exception is either an exact string ID (`path:id`), a prefix ending
+    with `*` (e.g. `path/strings.xml:*` for all strings in a file), or a
+    pattern using other `fnmatch` wildcards (`*`, `?`, `[seq]`).
+    """
+
+    def __init__(self, exceptions: dict[str, list[str]]):
+        self.exact: dict[str, set[str]] = {}
+        self.prefixes: dict[str, tuple[str, ...]] = {}
+        self.patterns: dict[str, re.Pattern[str]] = {}
+        for category, string_ids in exceptions.items():
+            exact = set()
+            prefixes = []
+            patterns = []
+            for string_id in string_ids:
+                if not self.is_pattern(string_id):
+                    exact.add(string_id)
+                elif string_id.endswith("*") and not self.is_pattern(string_id[:-1]):
+                    prefixes.append(string_id[:-1])
+                else:
+                    patterns.append(translate(string_id))
+            self.exact[category] = exact
+            if prefixes:
+                self.prefixes[category] = tuple(prefixes)
+            if patterns:
+                self.patterns[category] = re.compile("|".join(patterns))
+
+    @staticmethod
+    def is_pattern(string_id: str) -> bool:
+        """Check if an exception uses wildcards rather than an exact string ID."""
+
+        return any(char in string_id for char in "*?[")
+
+    def matches(self, category: str, string_id: str) -> bool:
+        """Check if a string ID is covered by the exceptions of a category."""
+
+        if string_id in self.exact.get(category, ()):
+            return True
+        prefixes = self.prefixes.get(category)
+        if prefixes and string_id.startswith(prefixes):
+            return True
+        pattern = self.patterns.get(category)
+        return bool(pattern and pattern.match(string_id))
+
+
+def get_entries(
+    filename: str, index: StringIndex | None = None
+) -> list[dict[str, str]]:
+    """Return the entries of the file from `index` if available, or by parsing it."""
+
+    entries = index.get(filename) if index else None
+    if entries is None:
+        entries = extract_entries(filename)
+        if index:
+            index.put(filename, entries)
+    return entries
+
+
+def parse_file(
+    filename: str,
+    storage: dict[str, dict[str, str]],
+    id_base: str,
+    index: StringIndex | None = None,
+) -> None:
     try:
-        resource = parse_resource(filename, android_literal_quotes=True)
-
-        for section in resource.sections:
-            for entry in section.entries:
-                if isinstance(entry, Entry):
-                    string_id = ".".join(section.id + entry.id)
-                    string_id = f"{id_base}:{string_id}"
-
-                    # If it's a plural string in Android, each variant
-                    # is stored within the message, following a format
-                    # similar to Fluent.
-                    if hasattr(entry.value, "variants"):
-                        storage[string_id] = {
-                            "value": serialize_select_variants(entry),
-                            "comment": entry.comment,
-                        }
-                    else:
-                        storage[string_id] = {
-                            "value": get_entry_value(entry.value),
-                            "comment": entry.comment,
-                        }
+        for entry in get_entries(filename, index):
+            string_id = f"{id_base}:{entry['id']}"
+            storage[string_id] = {
+                "value": entry["value"],
+                "comment": entry["comment"],
+            }
     except Exception as e:
         print(f"Error parsing file: {filename}")
         print(e)
@@ -81,9 +317,25 @@ class HTMLStripper(HTMLParser):
         return " ".join(self.fed)
 
 
+# One stripper per thread, reset between strings instead of being rebuilt
+_strippers = threading.local()
+
+
 def strip_html(html: str) -> str:
-    html = unescape(html)
+    # Without markup or character references, the parser would return the
+    # text unchanged
+    if "<" not in html and "&" not in html:
+        return html
+
+    return _strip_markup(html)
+
 
-    stripper = HTMLStripper()
-    stripper.feed(html)
+@lru_cache(maxsize=4096)
+def _strip_markup(html: str) -> str:
+    stripper = getattr(_strippers, "stripper", None)
+    if stripper is None:
+        stripper = _strippers.stripper = HTMLStripper()
+    else:
+        stripper.clear()
+    stripper.feed(unescape(html))
     return stripper.get_data()
@@ -0,0 +1,207 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from base64 import b64decode, b64encode
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from hashlib import sha256
+from requests.structures import CaseInsensitiveDict
+import json
+import os
+import tempfile
+import time
+import requests
+
+
+class HTTPClient:
+    """
+    HTTP client shared by scripts querying GitHub and other web services.
+
+    Connections are kept alive in a session, requests time out, and failed
+    requests are retried with exponential backoff, honoring `Retry-After` and
+    GitHub's rate limit headers. The token is only sent with requests to the
+    API, not to other hosts (e.g. raw files).
+
+    If `cache_dir` is set, responses to GET requests are stored there with
+    their ETag, and reused without any request for `ttl` seconds. Older entries
+    are revalidated with `If-None-Match`. Missing resources (404) are cached
+    too.
+    """
+
+    retry_statuses = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        token: str | None = None,
+        api_url: str = "https://api.github.com",
+        timeout: float = 30,
+        max_retries: int = 3,
+        backoff: float = 1,
+        max_delay: float = 60,
+        max_workers: int = 8,
+        cache_dir: str | None = None,
+        ttl: float = 0,
+    ):
+        self.session = requests.Session()
+        self.token = token
+        self.api_url = api_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.max_workers = max_workers
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+    def retry_delay(self, response: requests.Response | None, attempt: int) -> float:
+        """Return how long to wait before retrying a request."""
+
+        delay = self.backoff * 2**attempt
+        if response is None:
+            return delay
+
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            if retry_after.isdigit():
+                return float(retry_after)
+            try:
+                return max(
+                    0, parsedate_to_datetime(retry_after).timestamp() - time.time()
+                )
+            except (TypeError, ValueError):
+                return delay
+
+        # GitHub signals an exhausted rate limit with a 403 or 429 status
+        if response.headers.get("X-RateLimit-Remaining") == "0":
+            reset = response.headers.get("X-RateLimit-Reset", "")
+            if reset.isdigit():
+                return max(0, int(reset) - time.time()) + 1
+
+        return delay
+
+    def should_retry(self, response: requests.Response) -> bool:
+        if response.status_code in self.retry_statuses:
+            return True
+        return (
+            response.status_code == 403
+            and response.headers.get("X-RateLimit-Remaining") == "0"
+        )
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Send a request, retrying on connection errors, server errors and rate
+        limits. The response of the last attempt is returned, also when the
+        server asks to wait longer than `max_delay` seconds before retrying.
+        """
+
+        kwargs.setdefault("timeout", self.timeout)
+        if self.token and (url == self.api_url or url.startswith(f"{self.api_url}/")):
+            kwargs["headers"] = {
+                "Authorization": f"token {self.token}",
+                **(kwargs.get("headers") or {}),
+            }
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                response = None
+            else:
+                if attempt >= self.max_retries or not self.should_retry(response):
+                    return response
+            delay = self.retry_delay(response, attempt)
+            if response is not None and delay > self.max_delay:
+                # Don't stall the caller until a distant rate limit reset
+                return response
+            time.sleep(min(delay, self.max_delay))
+            attempt += 1
+
+    def cache_path(self, url: str) -> str:
+        key = sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def read_cache(self, url: str) -> dict | None:
+        try:
+            with open(self.cache_path(url)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get("url") == url else None
+
+    def write_cache(self, url: str, entry: dict) -> None:
+        """Store a cache entry, replacing the file as threads can write it."""
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry = {**entry, "url": url, "fetched": time.time()}
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.cache_dir, suffix=".tmp", delete=False
+        ) as f:
+            json.dump(entry, f)
+        os.replace(f.name, self.cache_path(url))
+
+    def cached_response(self, entry: dict) -> requests.Response:
+        response = requests.Response()
+        response.url = entry["url"]
+        response.status_code = entry["status"]
+        response.reason = entry["reason"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = entry["encoding"]
+        response._content = b64decode(entry["content"])
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """
+        Send a GET request. Unless the response is streamed, it's cached on
+        disk if `cache_dir` is set.
+        """
+
+        if not self.cache_dir or kwargs.get("stream"):
+            return self.request("GET", url, **kwargs)
+
+        entry = self.read_cache(url)
+        if entry and time.time() - entry["fetched"] < self.ttl:
+            return self.cached_response(entry)
+        etag = entry and CaseInsensitiveDict(entry["headers"]).get("ETag")
+        if etag:
+            kwargs["headers"] = {**(kwargs.get("headers") or {}), "If-None-Match": etag}
+
+        response = self.request("GET", url, **kwargs)
+        if entry and response.status_code == 304:
+            # Unchanged, reset the TTL of the cached entry
+            self.write_cache(url, entry)
+            return self.cached_response(entry)
+        if response.ok or response.status_code == 404:
+            self.write_cache(
+                url,
+                {
+                    "status": response.status_code,
+                    "reason": response.reason,
+                    "headers": {
+                        key: value
+                        for key, value in response.headers.items()
+                        if key.lower() in ("content-type", "etag")
+                    },
+                    "encoding": response.encoding,
+                    "content": b64encode(response.content).decode("ascii"),
+                },
+            )
+
+        return response
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def map(self, func, items) -> list:
+        """
+        Call func for each item using a bounded pool of threads, and return
+        the results in the same order as the items.
+        """
+
+        items = list(items)
+        if len(items) < 2 or self.max_workers < 2:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(func, items))
@@ -16,11 +16,13 @@ Reports:
   has no CLDR equivalent or differs from the CLDR English name.
 """
 
+import argparse
 import json
 import re
 import sys
-import urllib.request
-from urllib.error import URLError
+
+import requests
+from fetcher import Fetcher, add_fetch_arguments, get_fetcher
 
 # Locale codes to skip in all checks
 EXCEPTIONS = [
@@ -50,22 +52,21 @@ LOCALE_UTILS_URL = (
 # ---------------------------------------------------------------------------
 
 
-def fetch_url(url: str) -> str:
+def fetch_url(fetcher: Fetcher, url: str) -> str:
     try:
-        with urllib.request.urlopen(url) as resp:
-            return resp.read().decode("utf-8")
-    except URLError as exc:
+        return fetcher.fetch(url)
+    except requests.RequestException as exc:
         print(f"ERROR fetching {url}: {exc}", file=sys.stderr)
         sys.exit(1)
 
 
-def fetch_cldr_languages() -> dict[str, str]:
+def fetch_cldr_languages(fetcher: Fetcher) -> dict[str, str]:
     """Return {locale_code: english_name} from CLDR en/languages.json."""
-    data = json.loads(fetch_url(CLDR_URL))
+    data = json.loads(fetch_url(fetcher, CLDR_URL))
     return data["main"]["en"]["localeDisplayNames"]["languages"]
 
 
-def fetch_cldr_self_name(code: str) -> str | None:
+def fetch_cldr_self_name(fetcher: Fetcher, code: str) -> str | None:
     """
     Return the locale's own-language name from its CLDR languages.json, or None
     if the file doesn't exist or the self-entry is absent.
@@ -76,15 +77,20 @@ def fetch_cldr_self_name(code: str) -> str | None:
     )
     url = f"{base_url}/{code}/languages.json"
     try:
-        with urllib.request.urlopen(url) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
+        data = json.loads(fetcher.fetch(url))
         langs = data["main"][code]["localeDisplayNames"]["languages"]
         return langs.get(code)
     except Exception:
         return None
 
 
-def fetch_pontoon_locales() -> dict[str, dict]:
+def fetch_cldr_self_names(fetcher: Fetcher, codes: list[str]) -> dict[str, str | None]:
+    """Return {locale_code: self_name} for codes, fetching them concurrently."""
+    names = fetcher.map(lambda code: fetch_cldr_self_name(fetcher, code), codes)
+    return dict(zip(codes, names))
+
+
+def fetch_pontoon_locales(fetcher: Fetcher) -> dict[str, dict]:
     """
     Return locales with approved_strings > 0 from Pontoon.
 
@@ -99,7 +105,7 @@ def fetch_pontoon_locales() -> dict[str, dict]:
     url: str | None = PONTOON_URL
 
     while url:
-        data = json.loads(fetch_url(url))
+        data = json.loads(fetch_url(fetcher, url))
         for loc in data.get("localizations", []):
             approved = loc.get("approved_strings", 0)
             if approved <= 0:
@@ -152,14 +158,21 @@ def cldr_name_for(cldr_languages: dict[str, str], code: str) -> str | None:
 
 
 def main() -> None:
-    print("Fetching CLDR language names …")
-    cldr_languages = fetch_cldr_languages()
-
-    print("Fetching Pontoon completion data …")
-    all_pontoon = fetch_pontoon_locales()
-
-    print("Fetching LocaleUtils.kt …")
-    kt_lines = fetch_url(LOCALE_UTILS_URL).splitlines()
+    parser = argparse.ArgumentParser()
+    add_fetch_arguments(parser)
+    args = parser.parse_args()
+    fetcher = get_fetcher(args)
+
+    print("Fetching CLDR language names, Pontoon data and LocaleUtils.kt …")
+    cldr_languages, all_pontoon, kt_source = fetcher.map(
+        lambda fetch: fetch(),
+        [
+            lambda: fetch_cldr_languages(fetcher),
+            lambda: fetch_pontoon_locales(fetcher),
+            lambda: fetch_url(fetcher, LOCALE_UTILS_URL),
+        ],
+    )
+    kt_lines = kt_source.splitlines()
     native_map = parse_kotlin_map(
         kt_lines, "private val LOCALE_TO_DISPLAY_NATIVE_NAME_MAP"
     )
@@ -197,9 +210,7 @@ def main() -> None:
     print("=" * 75)
     if missing_native_no_cldr:
         # Fetch CLDR self-names for each locale
-        self_names = {
-            code: fetch_cldr_self_name(code) for code in missing_native_no_cldr
-        }
+        self_names = fetch_cldr_self_names(fetcher, missing_native_no_cldr)
         header = (
             f"{'Code':<15} {'Pontoon name':<30} {'Missing strings':>15}  CLDR self-name"
         )
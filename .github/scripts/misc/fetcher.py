@@ -0,0 +1,114 @@
+"""
+HTTP fetching shared by the language switcher checks.
+
+Requests go through HTTPClient, with responses cached on disk (see its
+`cache_dir` and `ttl` options).
+
+Fixture directories can be used as offline sources: a URL is read from
+<fixtures>/<host>/<path>, with `index` as the file name for paths ending with
+"/", and "?<query>" appended to the file name if the URL has a query. URLs
+without a fixture file are reported as missing (404) and never fetched.
+"""
+
+from urllib.parse import urlsplit
+import os
+import sys
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from http_client import HTTPClient  # noqa: E402
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "android-l10n-checks",
+)
+
+
+class Fetcher(HTTPClient):
+    def __init__(self, fixtures_dirs: list[str] | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self.fixtures_dirs = fixtures_dirs or []
+
+    def fixture_path(self, fixtures_dir: str, url: str) -> str:
+        parts = urlsplit(url)
+        path = parts.path.lstrip("/")
+        if not path or path.endswith("/"):
+            path += "index"
+        if parts.query:
+            path += f"?{parts.query}"
+        return os.path.join(fixtures_dir, parts.netloc, *path.split("/"))
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        if not self.fixtures_dirs:
+            return super().get(url, **kwargs)
+
+        response = requests.Response()
+        response.url = url
+        response.status_code = 404
+        response.reason = "No fixture file"
+        response._content = b""
+        for fixtures_dir in self.fixtures_dirs:
+            path = self.fixture_path(fixtures_dir, url)
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    response._content = f.read()
+                response.status_code = 200
+                response.reason = "OK"
+                break
+        return response
+
+    def fetch(self, url: str) -> str:
+        """
+        Return the content of url as text. Raises requests.HTTPError if the
+        resource is missing, and requests.RequestException if it can't be
+        fetched.
+        """
+
+        response = self.get(url)
+        response.raise_for_status()
+        return response.content.decode("utf-8")
+
+
+def add_fetch_arguments(parser) -> None:
+    """Add the command line options used to create a Fetcher."""
+
+    parser.add_argument(
+        "--cache-dir",
+        default=DEFAULT_CACHE_DIR,
+        help=f"Folder used to cache responses (default: {DEFAULT_CACHE_DIR})",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't read or write cached responses",
+    )
+    parser.add_argument(
+        "--ttl",
+        type=float,
+        default=3600,
+        help="Seconds during which cached responses are used without "
+        "revalidation (default: 3600)",
+    )
+    parser.add_argument(
+        "--fixtures",
+        dest="fixtures_dirs",
+        action="append",
+        help="Folder with local copies of the remote files, used instead of "
+        "the network (can be repeated)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=8,
+        help="Number of concurrent requests (default: 8)",
+    )
+
+
+def get_fetcher(args) -> Fetcher:
+    return Fetcher(
+        fixtures_dirs=args.fixtures_dirs,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        ttl=args.ttl,
+        max_workers=max(args.jobs, 1),
+    )
@@ -12,11 +12,13 @@ Reports:
   fillLanguageCodeAndNameMap, along with CLDR self-name if available.
 """
 
+import argparse
 import json
 import re
 import sys
-import urllib.request
-from urllib.error import URLError
+
+import requests
+from fetcher import Fetcher, add_fetch_arguments, get_fetcher
 
 # Locale codes to skip in all checks
 EXCEPTIONS = [
@@ -47,22 +49,21 @@ LOCALE_DESCRIPTOR_URL = (
 # ---------------------------------------------------------------------------
 
 
-def fetch_url(url: str) -> str:
+def fetch_url(fetcher: Fetcher, url: str) -> str:
     try:
-        with urllib.request.urlopen(url) as resp:
-            return resp.read().decode("utf-8")
-    except URLError as exc:
+        return fetcher.fetch(url)
+    except requests.RequestException as exc:
         print(f"ERROR fetching {url}: {exc}", file=sys.stderr)
         sys.exit(1)
 
 
-def fetch_cldr_languages() -> dict[str, str]:
+def fetch_cldr_languages(fetcher: Fetcher) -> dict[str, str]:
     """Return {locale_code: english_name} from CLDR en/languages.json."""
-    data = json.loads(fetch_url(CLDR_URL))
+    data = json.loads(fetch_url(fetcher, CLDR_URL))
     return data["main"]["en"]["localeDisplayNames"]["languages"]
 
 
-def fetch_cldr_self_name(code: str) -> str | None:
+def fetch_cldr_self_name(fetcher: Fetcher, code: str) -> str | None:
     """
     Return the locale's own-language name from its CLDR languages.json, or None
     if the file doesn't exist or the self-entry is absent.
@@ -77,8 +78,7 @@ def fetch_cldr_self_name(code: str) -> str | None:
     for try_code in dict.fromkeys([code, base]):  # deduplicate while preserving order
         url = f"{base_url}/{try_code}/languages.json"
         try:
-            with urllib.request.urlopen(url) as resp:
-                data = json.loads(resp.read().decode("utf-8"))
+            data = json.loads(fetcher.fetch(url))
             langs = data["main"][try_code]["localeDisplayNames"]["languages"]
             name = langs.get(code) or langs.get(base)
             if name:
@@ -88,7 +88,13 @@ def fetch_cldr_self_name(code: str) -> str | None:
     return None
 
 
-def fetch_pontoon_locales() -> dict[str, dict]:
+def fetch_cldr_self_names(fetcher: Fetcher, codes: list[str]) -> dict[str, str | None]:
+    """Return {locale_code: self_name} for codes, fetching them concurrently."""
+    names = fetcher.map(lambda code: fetch_cldr_self_name(fetcher, code), codes)
+    return dict(zip(codes, names))
+
+
+def fetch_pontoon_locales(fetcher: Fetcher) -> dict[str, dict]:
     """
     Return locales with approved_strings > 0 from Pontoon.
 
@@ -103,7 +109,7 @@ def fetch_pontoon_locales() -> dict[str, dict]:
     url: str | None = PONTOON_URL
 
     while url:
-        data = json.loads(fetch_url(url))
+        data = json.loads(fetch_url(fetcher, url))
         for loc in data.get("localizations", []):
             approved = loc.get("approved_strings", 0)
             if approved <= 0:
@@ -162,13 +168,20 @@ def cldr_name_for(cldr_languages: dict[str, str], code: str) -> str | None:
 
 
 def main() -> None:
-    print("Fetching CLDR language names …")
-
-    print("Fetching Pontoon completion data …")
-    all_pontoon = fetch_pontoon_locales()
-
-    print("Fetching LocaleDescriptor.kt …")
-    kt_lines = fetch_url(LOCALE_DESCRIPTOR_URL).splitlines()
+    parser = argparse.ArgumentParser()
+    add_fetch_arguments(parser)
+    args = parser.parse_args()
+    fetcher = get_fetcher(args)
+
+    print("Fetching Pontoon completion data and LocaleDescriptor.kt …")
+    all_pontoon, kt_source = fetcher.map(
+        lambda fetch: fetch(),
+        [
+            lambda: fetch_pontoon_locales(fetcher),
+            lambda: fetch_url(fetcher, LOCALE_DESCRIPTOR_URL),
+        ],
+    )
+    kt_lines = kt_source.splitlines()
     locale_map = parse_language_code_map(kt_lines)
 
     # Apply exceptions
@@ -196,7 +209,7 @@ def main() -> None:
 
     # Fetch CLDR self-names for candidates and split into two groups
     print(f"\nFetching CLDR self-names for {len(not_in_map)} locales not in map …")
-    self_names = {code: fetch_cldr_self_name(code) for code in not_in_map}
+    self_names = fetch_cldr_self_names(fetcher, not_in_map)
 
     missing_no_cldr = [c for c in not_in_map if not self_names[c]]
     missing_has_cldr = [c for c in not_in_map if self_names[c]]
@@ -6,7 +6,7 @@
 
 # This script output errors from a JSON file to a TXT file.
 
-from reference_linter import outputErrors
+from reference_linter import writeErrors
 import argparse
 import json
 import os
@@ -27,6 +27,20 @@ def main():
         dest="dest_file",
         help="Path to dest TXT file",
     )
+    parser.add_argument(
+        "--format",
+        default="markdown",
+        choices=["markdown", "text", "jsonl"],
+        dest="format",
+        help="Output format",
+    )
+    parser.add_argument(
+        "--max-size",
+        type=int,
+        dest="max_size",
+        help="Maximum size of the output in characters, errors exceeding it are "
+        "only counted",
+    )
     args = parser.parse_args()
 
     if not os.path.isfile(args.json_file):
@@ -38,9 +52,8 @@ def main():
         print("No errors found.")
         sys.exit(0)
 
-    output = outputErrors(errors)
     with open(args.dest_file, "w") as f:
-        f.writelines(output)
+        writeErrors(errors, f, args.format, args.max_size)
 
 
 if __name__ == "__main__":
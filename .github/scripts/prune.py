@@ -6,101 +6,189 @@
 Prune localization files after updates from supported branches.
 
 Expects to find `_data/[project]/[branch].json` for each project,
-and removes any other JSON data files in `_data/`.
+and removes any other JSON data files in `_data/`,
+except for the `[branch].hashes.json` files of supported branches.
 Removes any files and messages not used by any branch.
+With --locales, also removes unused messages from all localized files.
 
 Writes a commit message summary as `.prune_msg`.
 """
 
 import json
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 from os import remove, scandir, pardir
-from os.path import join, relpath, splitext, isdir, abspath, dirname
+from os.path import join, relpath, splitext, isdir, abspath, dirname, exists
 from sys import exit
-from moz.l10n.paths.config import L10nConfigPaths
-from moz.l10n.resource import parse_resource, serialize_resource
-from moz.l10n.model import Entry
-
-
-def prune_file(path: str, msg_refs: set[str], repo_root: str) -> int:
-    with open(path, "+rb") as file:
-        resource = parse_resource(path, file.read())
-        drop_count = 0
-        for section in resource.sections:
-            next = [
-                entry
-                for entry in section.entries
-                if not isinstance(entry, Entry)
-                or ".".join(section.id + entry.id) in msg_refs
-            ]
-            diff = len(section.entries) - len(next)
-            if diff > 0:
-                drop_count += diff
-                section.entries = next
-        resource.sections = [
-            section for section in resource.sections if section.entries
+from moz.l10n.paths import L10nConfigPaths, get_android_locale
+from moz.l10n.resource import parse_resource
+from moz.l10n.model import Entry, Resource
+
+from functions import write_resource
+
+
+def prune_resource(resource: Resource, msg_refs: set[str]) -> int:
+    """Drop any messages not in `msg_refs` from `resource`, returning their count."""
+    drop_count = 0
+    for section in resource.sections:
+        next = [
+            entry
+            for entry in section.entries
+            if not isinstance(entry, Entry)
+            or ".".join(section.id + entry.id) in msg_refs
         ]
-        if drop_count:
-            print(f"drop {drop_count} from {relpath(path, repo_root)}")
-            file.seek(0)
-            for line in serialize_resource(resource):
-                file.write(line.encode("utf-8"))
-            file.truncate()
+        diff = len(section.entries) - len(next)
+        if diff > 0:
+            drop_count += diff
+            section.entries = next
+    resource.sections = [section for section in resource.sections if section.entries]
     return drop_count
 
 
-def prune(
+def prune_file(path: str, msg_refs: set[str]) -> int:
+    """Drop any messages not in `msg_refs` from the file at `path`."""
+    resource = parse_resource(path)
+    drop_count = prune_resource(resource, msg_refs)
+    if drop_count:
+        write_resource(path, resource)
+    return drop_count
+
+
+def scan_data(
     project: str, branches: list[str], repo_root: str
-) -> tuple[list[str], int, int]:
-    project_path = join(repo_root, "mozilla-mobile", project)
-    data_path = join(repo_root, "_data", project)
+) -> tuple[list[str], dict[str, str]]:
+    """
+    Remove any JSON data files of the project which are not for one of `branches`.
 
-    removed_data = []
-    removed_files = 0
-    removed_messages = 0
-    refs: dict[str, set[str]] = {}
-    expected = set(branches)
+    Returns the removed branches, and the data file path of each found branch.
+    """
+    data_path = join(repo_root, "_data", project)
 
     if not isdir(data_path):
         exit(f"_data directory does not exist: {data_path}")
 
+    removed_data = []
+    data_files: dict[str, str] = {}
     for entry in scandir(data_path):
         branch, ext = splitext(entry.name)
 
         if entry.is_file() and ext == ".json":
+            if branch.endswith(".hashes"):
+                # Source file hashes written by update.py
+                if branch.removesuffix(".hashes") not in branches:
+                    print(f"remove {relpath(entry.path, repo_root)}")
+                    remove(entry.path)
+                continue
             if branch in branches:
-                expected.remove(branch)
-                with open(entry.path, "r") as file:
-                    data: dict[str, list[str]] = json.load(file)
-
-                for path, keys in data.items():
-                    if path in refs:
-                        refs[path].update(keys)
-                    else:
-                        refs[path] = set(keys)
+                data_files[branch] = entry.path
             else:
                 print(f"remove {relpath(entry.path, repo_root)}")
                 remove(entry.path)
                 removed_data.append(branch)
+    return removed_data, data_files
 
-    if not refs:
-        exit(f"No data found for: {branches}")
-    if expected:
-        exit(f"Incomplete data! Not found: {expected}")
 
-    cfg_path = join(project_path, "l10n.toml")
+def prune_paths(
+    project: str,
+    refs: dict[str, set[str]],
+    repo_root: str,
+    prune_messages: bool = True,
+) -> tuple[int, int]:
+    """
+    Remove the project's reference files not in `refs`,
+    and unless `prune_messages` is false, any messages not in `refs`.
+
+    Returns the number of removed files and messages.
+    """
+    removed_files = 0
+    removed_messages = 0
+    cfg_path = join(repo_root, "mozilla-mobile", project, "l10n.toml")
     for path in L10nConfigPaths(cfg_path).ref_paths:
         rel_path = relpath(path, repo_root)
         if rel_path not in refs:
             print(f"remove {path}")
             remove(path)
             removed_files += 1
-        elif refs[rel_path]:
-            removed_messages += prune_file(path, refs[rel_path], repo_root)
-    return removed_data, removed_files, removed_messages
+        elif refs[rel_path] and prune_messages:
+            drop_count = prune_file(path, refs[rel_path])
+            if drop_count:
+                print(f"drop {drop_count} from {rel_path}")
+                removed_messages += drop_count
+    return removed_files, removed_messages
+
+
+def prune_locales(
+    project: str, refs: dict[str, set[str]], repo_root: str, jobs: int = 1
+) -> int:
+    """
+    Drop any messages not in `refs` from the localized files of all locales,
+    using `jobs` worker processes.
+
+    Returns the number of removed messages.
+    """
+    cfg_path = join(repo_root, "mozilla-mobile", project, "l10n.toml")
+    paths = L10nConfigPaths(cfg_path, locale_map={"android_locale": get_android_locale})
+
+    tgt_paths: list[str] = []
+    msg_refs: list[set[str]] = []
+    for (ref_path, tgt_path), locales in paths.all().items():
+        rel_path = relpath(ref_path, repo_root)
+        if not refs.get(rel_path):
+            continue
+        for locale in locales or []:
+            path = paths.format_target_path(tgt_path, locale)
+            if exists(path):
+                tgt_paths.append(path)
+                msg_refs.append(refs[rel_path])
+
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(prune_file, tgt_paths, msg_refs))
+    else:
+        results = map(prune_file, tgt_paths, msg_refs)
+
+    removed_messages = 0
+    for path, drop_count in zip(tgt_paths, results):
+        if drop_count:
+            print(f"drop {drop_count} from {relpath(path, repo_root)}")
+            removed_messages += drop_count
+    return removed_messages
+
+
+def prune(
+    project: str,
+    branches: list[str],
+    repo_root: str,
+    locales: bool = False,
+    jobs: int = 1,
+) -> tuple[list[str], int, int, int]:
+    refs: dict[str, set[str]] = {}
+
+    removed_data, data_files = scan_data(project, branches, repo_root)
+    for data_file in data_files.values():
+        with open(data_file, "r") as file:
+            data: dict[str, list[str]] = json.load(file)
+
+        for path, keys in data.items():
+            if path in refs:
+                refs[path].update(keys)
+            else:
+                refs[path] = set(keys)
+
+    if not refs:
+        exit(f"No data found for: {branches}")
+    expected = set(branches).difference(data_files)
+    if expected:
+        exit(f"Incomplete data! Not found: {expected}")
 
+    removed_files, removed_messages = prune_paths(project, refs, repo_root)
+    removed_localized = prune_locales(project, refs, repo_root, jobs) if locales else 0
+    return removed_data, removed_files, removed_messages, removed_localized
 
-def write_commit_msg(data: list[str], files: int, messages: int, repo_root: str):
+
+def write_commit_msg(
+    data: list[str], files: int, messages: int, repo_root: str, localized: int = 0
+):
     summary = []
     for branch in data:
         summary.append(f"{branch} data")
@@ -110,6 +198,12 @@ def write_commit_msg(data: list[str], files: int, messages: int, repo_root: str)
         summary.append(
             f"{messages} message" if messages == 1 else f"{messages} messages"
         )
+    if localized:
+        summary.append(
+            f"{localized} localized message"
+            if localized == 1
+            else f"{localized} localized messages"
+        )
     with open(join(repo_root, ".prune_msg"), "w") as file:
         file.write(f"Removed: {', '.join(summary)}" if summary else "no changes")
 
@@ -130,7 +224,20 @@ if __name__ == "__main__":
         choices=["fenix", "android-components", "focus-android"],
         help='The project identifier, e.g. "fenix", "android-components", or "focus-android".',
     )
+    parser.add_argument(
+        "--locales",
+        action="store_true",
+        help="Also remove unused messages from the localized files of all locales.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes used to prune localized files (default: 1).",
+    )
     args = parser.parse_args()
 
-    removed = prune(args.project, cfg_automation["branches"], repo_root)
-    write_commit_msg(*removed, repo_root)
+    data, files, messages, localized = prune(
+        args.project, cfg_automation["branches"], repo_root, args.locales, args.jobs
+    )
+    write_commit_msg(data, files, messages, repo_root, localized)
@@ -12,40 +12,85 @@
 # with return value 1.
 
 from collections import defaultdict
-from functions import parse_file, strip_html
+from functions import (
+    ExceptionIndex,
+    StringIndex,
+    parse_file,
+    strip_html,
+    write_file,
+)
 from moz.l10n.paths import L10nConfigPaths, get_android_locale
 import argparse
-import copy
+import filecmp
 import json
 import os
 import re
 import sys
 
+# Files defining the checks: if any of them changed, all reference files need to
+# be checked again, not only the changed ones.
+SCRIPTS_PATH = os.path.dirname(os.path.abspath(__file__))
+LINTER_FILES = [
+    os.path.join(SCRIPTS_PATH, "reference_linter.py"),
+    os.path.join(SCRIPTS_PATH, "functions.py"),
+    os.path.join(os.path.dirname(SCRIPTS_PATH), "requirements.txt"),
+]
+
 
 class StringExtraction:
-    def __init__(self, toml_path):
+    def __init__(self, toml_path, index=None, parsed_files=None):
         """Initialize object."""
 
         self.ref_strings = {}
         self.toml_path = toml_path
+        self.index = index
+        # Strings by reference file, can be shared between instances to parse
+        # files included by multiple TOML files only once
+        self.parsed_files = {} if parsed_files is None else parsed_files
 
-    def extractStrings(self):
-        """Extract strings using TOML configuration."""
+    def getReferenceFiles(self):
+        """Return the list of reference files from the TOML configuration."""
 
         project_config_paths = L10nConfigPaths(
             self.toml_path, locale_map={"android_locale": get_android_locale}
         )
 
-        reference_files = [
+        return [
             ref_path.format(android_locale=None)
             for (ref_path, tgt_path), locales in project_config_paths.all().items()
         ]
+
+    def extractStrings(self, files=None):
+        """
+        Extract strings using TOML configuration.
+
+        If a list of files is provided, only reference files included in it
+        are parsed.
+        """
+
+        reference_files = self.getReferenceFiles()
+        if files is not None:
+            files = {os.path.normpath(f) for f in files}
+            reference_files = [
+                f for f in reference_files if os.path.normpath(f) in files
+            ]
         for reference_file in reference_files:
+            if reference_file in self.parsed_files:
+                self.ref_strings.update(self.parsed_files[reference_file])
+                continue
+            file_strings = {}
             try:
-                parse_file(reference_file, self.ref_strings, f"{reference_file}")
+                parse_file(
+                    reference_file,
+                    file_strings,
+                    f"{reference_file}",
+                    self.index,
+                )
+                self.parsed_files[reference_file] = file_strings
             except Exception as e:
                 print(f"Error parsing resource: {reference_file}")
                 print(e)
+            self.ref_strings.update(file_strings)
 
         print(f"{len(self.ref_strings)} strings extracted")
 
@@ -55,83 +100,151 @@ class StringExtraction:
         return self.ref_strings
 
 
-class QualityCheck:
-    def __init__(self, ref_strings, config_path, toml_path):
-        self.ref_strings = ref_strings
-        self.config_path = config_path
-        self.toml_path = toml_path
-        self.errors = {toml_path: defaultdict(dict)}
-        self.placeable_pattern = re.compile(r"%(?:\d+\$)?(?:\.[0-9]+)?[sdf]")
-
-        self.runChecks()
-
-    def runChecks(self):
-        """Check translations for issues"""
+def trieRegex(words):
+    """
+    Return a regular expression matching any of the words, with common
+    prefixes merged so that matching doesn't slow down as more words are added.
+    Longer words are preferred over their prefixes.
+    """
+
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        alternatives = [
+            re.escape(char) + build(child)
+            for char, child in sorted(node.items())
+            if char != ""
+        ]
+        if not alternatives:
+            return ""
+        pattern = (
+            alternatives[0]
+            if len(alternatives) == 1
+            else f"(?:{'|'.join(alternatives)})"
+        )
+        if "" in node:
+            return f"(?:{pattern})?"
+        return pattern
 
-        def storeError(string_id, error_msg):
-            filename, id = string_id.split(":")
-            if id in self.errors[self.toml_path].get(filename, {}):
-                self.errors[self.toml_path][filename][id]["errors"].append(error_msg)
-            else:
-                self.errors[self.toml_path][filename][id] = {
-                    "value": self.ref_strings[string_id]["value"],
-                    "comment": self.ref_strings[string_id]["comment"],
-                    "errors": [error_msg],
-                }
+    return build(trie)
 
-        def ignoreString(exceptions, errorcode, string_id):
-            """Check if a string should be ignored"""
 
-            if not exceptions:
-                return False
+class QualityCheck:
+    def __init__(self, config_path):
+        self.config_path = config_path
+        self.errors = {}
+        self.placeable_pattern = re.compile(r"%(?:\d+\$)?(?:\.[0-9]+)?[sdf]")
 
-            if string_id in exceptions.get(errorcode, []):
-                return True
+        self.loadConfig()
 
-            return False
+    def loadConfig(self):
+        """Load exceptions and brand names from config, and compile the scanner"""
 
-        # Load config
         if not self.config_path:
-            exceptions = {}
+            self.exceptions = ExceptionIndex({})
             brands = []
         else:
             try:
                 with open(self.config_path) as f:
                     config = json.load(f)
-                    exceptions = config["exceptions"]
+                    self.exceptions = ExceptionIndex(config["exceptions"])
                     brands = config["brands"]
             except Exception as e:
                 sys.exit(e)
 
-        for ref_id, ref_data in self.ref_strings.items():
+        self.compileScanner(brands)
+
+    def compileScanner(self, brands):
+        """
+        Compile a single pattern to find all ellipsis, straight quotes,
+        placeables and brand names in a string with one pass.
+        """
+
+        patterns = [r"\.\.\.", r"['\"]", self.placeable_pattern.pattern]
+        brands_pattern = trieRegex(brands)
+        if brands_pattern:
+            patterns.append(brands_pattern)
+        self.scanner = re.compile("|".join(patterns))
+
+        # The scanner only returns the longest brand starting at a given
+        # position, so store which brands each brand starts with.
+        self.brand_prefixes = {
+            brand: [prefix for prefix in brands if brand.startswith(prefix)]
+            for brand in brands
+        }
+        self.brand_order = {brand: n for n, brand in reversed(list(enumerate(brands)))}
+
+    def scanString(self, text):
+        """Return the set of tokens and brands found in the text by the scanner."""
+
+        tokens = set()
+        brands = set()
+        pos = 0
+        while match := self.scanner.search(text, pos):
+            token = match.group()
+            if token in self.brand_prefixes:
+                brands.update(self.brand_prefixes[token])
+            else:
+                tokens.add(token)
+            # Brands may overlap other matches, so continue from the next character
+            pos = match.start() + 1
+
+        return tokens, sorted(brands, key=self.brand_order.get)
+
+    def runChecks(self, ref_strings, toml_path):
+        """Check translations extracted from a TOML file for issues"""
+
+        errors = self.errors.setdefault(toml_path, defaultdict(dict))
+
+        def storeError(string_id, error_msg):
+            filename, id = string_id.split(":")
+            if id in errors.get(filename, {}):
+                errors[filename][id]["errors"].append(error_msg)
+            else:
+                errors[filename][id] = {
+                    "value": ref_strings[string_id]["value"],
+                    "comment": ref_strings[string_id]["comment"],
+                    "errors": [error_msg],
+                }
+
+        def ignoreString(exceptions, errorcode, string_id):
+            """Check if a string should be ignored"""
+
+            return exceptions.matches(errorcode, string_id)
+
+        exceptions = self.exceptions
+        for ref_id, ref_data in ref_strings.items():
             ref_string = ref_data["value"]
             ref_comment = ref_data["comment"]
             # Ignore strings excluded from all checks
             if ignoreString(exceptions, "general", ref_id):
                 continue
 
+            tokens, string_brands = self.scanString(ref_string)
+
             # Check for empty strings
             if ref_string == "":
                 storeError(ref_id, f"{ref_id} is empty")
 
             # Check for 3 dots instead of ellipsis
-            if "..." in ref_string:
+            if "..." in tokens:
                 storeError(
                     ref_id, "Incorrect ellipsis character `...`. Use `…` instead."
                 )
 
             # Check for straight single quotes
-            if "'" in ref_string and not ignoreString(
-                exceptions, "single_quotes", ref_id
-            ):
+            if "'" in tokens and not ignoreString(exceptions, "single_quotes", ref_id):
                 storeError(
                     ref_id, "Incorrect straight quote character `'`. use `’` instead."
                 )
 
             # Check for straight double quotes
-            if '"' in ref_string and not ignoreString(
-                exceptions, "double_quotes", ref_id
-            ):
+            if '"' in tokens and not ignoreString(exceptions, "double_quotes", ref_id):
                 # Check if the version without HTML is clean
                 cleaned_str = strip_html(ref_string)
                 if '"' in cleaned_str:
@@ -142,15 +255,14 @@ class QualityCheck:
 
             # Check for hard-coded brand names
             if not ignoreString(exceptions, "brand", ref_id):
-                for brand in brands:
-                    if brand in ref_string:
-                        storeError(
-                            ref_id,
-                            f"Hard-coded brand `{brand}`. Use a variable instead.",
-                        )
+                for brand in string_brands:
+                    storeError(
+                        ref_id,
+                        f"Hard-coded brand `{brand}`. Use a variable instead.",
+                    )
 
             # Check for missing placeable references in comments
-            string_placeables = set(re.findall(self.placeable_pattern, ref_string))
+            string_placeables = {token for token in tokens if token.startswith("%")}
             if string_placeables and not ignoreString(exceptions, "placeables", ref_id):
                 if ref_comment == "":
                     storeError(
@@ -171,61 +283,197 @@ class QualityCheck:
                     )
 
 
-def outputErrors(errors):
-    """Print error messages"""
+def getChangedFiles(file_paths, base_path, root_path="."):
+    """
+    Return the files that are new or different from their copy in base_path,
+    which has the same structure as root_path.
+    """
+
+    changed_files = []
+    for file_path in file_paths:
+        base_file = os.path.join(base_path, os.path.relpath(file_path, root_path))
+        if not os.path.isfile(base_file) or not filecmp.cmp(
+            file_path, base_file, shallow=False
+        ):
+            changed_files.append(file_path)
+
+    return changed_files
+
+
+def renderErrors(errors, format="markdown"):
+    """
+    Generate the report for errors line by line, as tuples with the line and
+    the number of errors it reports.
+
+    Supported formats are `markdown`, `text`, and `jsonl` (a JSON object for
+    each error).
+    """
 
-    output = []
     for config_name, config_errors in errors.items():
         if config_errors:
-            output.append(f"\n## TOML file: {config_name}")
+            if format == "markdown":
+                yield f"\n## TOML file: {config_name}", 0
+            elif format == "text":
+                yield f"\nTOML file: {config_name}", 0
         total = 0
         for filename, ids in config_errors.items():
-            output.append(f"\n### File: {filename}")
+            if format == "markdown":
+                yield f"\n### File: {filename}", 0
+            elif format == "text":
+                yield f"\nFile: {filename}", 0
             for id, file_data in ids.items():
-                output.append(f"\n**ID**: `{id}`")
-                output.append(rf"**Value**: `{file_data['value']}`")
-                output.append(rf"**Comment**: `{file_data.get('comment', '')}`")
-                output.append("**Errors:**")
+                value = file_data["value"]
+                comment = file_data.get("comment", "")
+                if format == "jsonl":
+                    for e in file_data["errors"]:
+                        error_data = {
+                            "toml": config_name,
+                            "file": filename,
+                            "id": id,
+                            "value": value,
+                            "comment": comment,
+                            "error": e,
+                        }
+                        yield json.dumps(error_data, ensure_ascii=False), 1
+                    continue
+                if format == "markdown":
+                    yield f"\n**ID**: `{id}`", 0
+                    yield rf"**Value**: `{value}`", 0
+                    yield rf"**Comment**: `{comment}`", 0
+                    yield "**Errors:**", 0
+                else:
+                    yield f"\n  ID: {id}", 0
+                    yield f"  Value: {value}", 0
+                    yield f"  Comment: {comment}", 0
+                    yield "  Errors:", 0
                 for e in file_data["errors"]:
-                    output.append(f"- {e}")
+                    yield f"- {e}" if format == "markdown" else f"  - {e}", 1
                     total += 1
         if total > 0:
-            output.append(f"\n**Total errors not yet reported:** {total}\n")
+            if format == "markdown":
+                yield f"\n**Total errors not yet reported:** {total}\n", 0
+            elif format == "text":
+                yield f"\nTotal errors not yet reported: {total}\n", 0
+
+
+def writeErrors(errors, output, format="markdown", max_size=None):
+    """
+    Write the report for errors to a file handle, line by line.
+
+    If max_size is set, the report is truncated to fit in max_size characters,
+    including a final line with the number of errors not included. Headers
+    (TOML, file, string) are only written with the first error following them,
+    so the report never ends with a header without errors.
+    """
+
+    if format not in ("markdown", "text", "jsonl"):
+        raise ValueError(f"Unknown output format: {format}")
+
+    def truncation_line(missing):
+        if format == "jsonl":
+            return json.dumps({"truncated": missing})
+        elif format == "markdown":
+            return f"\n**Output truncated:** {missing} errors not shown."
+        return f"\nOutput truncated: {missing} errors not shown."
+
+    missing = sum(
+        len(file_data["errors"])
+        for config_errors in errors.values()
+        for ids in config_errors.values()
+        for file_data in ids.values()
+    )
 
-    return "\n".join(output)
+    separator = ""
+    size = 0
+    truncated = False
+    # Lines without errors waiting for the next error line
+    pending = ""
+    for line, line_errors in renderErrors(errors, format):
+        pending += f"{separator}{line}"
+        separator = "\n"
+        if not line_errors:
+            continue
+        if max_size is not None:
+            # Leave room for the line reporting truncated errors, if any
+            remaining = missing - line_errors
+            reserved = len(f"\n{truncation_line(remaining)}") if remaining else 0
+            if size + len(pending) + reserved > max_size:
+                output.write(f"{separator if size else ''}{truncation_line(missing)}")
+                truncated = True
+                break
+        output.write(pending)
+        size += len(pending)
+        missing -= line_errors
+        pending = ""
+    if not truncated and pending:
+        # Trailing lines, e.g. totals, once all errors are written
+        if max_size is None or size + len(pending) <= max_size:
+            output.write(pending)
+    if format != "markdown" and separator:
+        output.write("\n")
 
 
 def mergeErrors(new_content, old_content):
-    merged_content = copy.deepcopy(new_content)
-    for config_name, config_errors in old_content.items():
-        if config_name not in merged_content:
-            merged_content[config_name] = {}
+    """
+    Merge new errors into old_content in place, and return it.
+
+    For strings with errors in both, the new value and comment are used, and
+    new errors are added after the existing ones, removing duplicates.
+    """
+
+    for config_name, config_errors in new_content.items():
+        merged_config = old_content.setdefault(config_name, {})
         for filename, string_ids in config_errors.items():
-            if filename not in merged_content[config_name]:
-                merged_content[config_name][filename] = {}
+            merged_file = merged_config.setdefault(filename, {})
             for string_id, file_data in string_ids.items():
-                if string_id in merged_content[config_name][filename]:
-                    # Assume the text in the same, only add the errors (removing duplicates).
-                    merged_errors = list(
-                        set(
-                            file_data["errors"]
-                            + merged_content[config_name][filename][string_id]["errors"]
-                        )
-                    )
-                    merged_content[config_name][filename][string_id]["errors"] = (
-                        merged_errors
-                    )
+                if string_id in merged_file:
+                    merged_errors = dict.fromkeys(merged_file[string_id]["errors"])
+                    merged_errors.update(dict.fromkeys(file_data["errors"]))
+                    merged_file[string_id] = {
+                        **file_data,
+                        "errors": list(merged_errors),
+                    }
                 else:
-                    merged_content[config_name][filename][string_id] = file_data
+                    merged_file[string_id] = file_data
+
+    return old_content
+
+
+def saveErrors(errors, json_file):
+    """
+    Add errors to a JSON file, merging them with the content already saved by
+    other checks.
+    """
+
+    print(f"Saving output to {json_file}")
+    if os.path.exists(json_file):
+        try:
+            with open(json_file, "r") as f:
+                previous_content = json.load(f)
+        except Exception:
+            previous_content = {}
+    else:
+        previous_content = {}
 
-    return merged_content
+    # Only store TOML files with errors
+    new_content = {
+        config_name: config_errors
+        for config_name, config_errors in errors.items()
+        if config_errors
+    }
+    merged_content = mergeErrors(new_content, previous_content)
+    write_file(json_file, json.dumps(merged_content, indent=2, sort_keys=True).encode())
 
 
 def main():
     # Read command line input parameters
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        "--toml", required=True, dest="toml_path", help="Path to l10n.toml file"
+        "--toml",
+        required=True,
+        dest="toml_paths",
+        nargs="+",
+        help="Path to l10n.toml files",
     )
     parser.add_argument(
         "--json",
@@ -239,38 +487,64 @@ def main():
         dest="config_file",
         help="Path to JSON file with extra config (exceptions, brand names, etc.)",
     )
+    parser.add_argument(
+        "--index",
+        dest="index_file",
+        help="Path to SQLite file used to store and reuse parsed strings",
+    )
+    changes_group = parser.add_mutually_exclusive_group()
+    changes_group.add_argument(
+        "--changed-files",
+        nargs="*",
+        dest="changed_files",
+        help="Only check strings in these reference files",
+    )
+    changes_group.add_argument(
+        "--base",
+        dest="base_path",
+        help="Folder with the previous version of the repository, to only check "
+        "strings in reference files that changed (all files are checked if the "
+        "TOML, config file or linter changed)",
+    )
     args = parser.parse_args()
 
-    extracted_strings = StringExtraction(args.toml_path)
-    extracted_strings.extractStrings()
-    ref_strings = extracted_strings.getTranslations()
+    index = StringIndex(args.index_file) if args.index_file else None
+    checks = QualityCheck(args.config_file)
+    parsed_files = {}
+    for toml_path in args.toml_paths:
+        extracted_strings = StringExtraction(toml_path, index, parsed_files)
+
+        files = args.changed_files
+        if args.base_path:
+            root_path = os.path.dirname(toml_path) or "."
+            config_files = [toml_path] + LINTER_FILES
+            if args.config_file:
+                config_files.append(args.config_file)
+            if getChangedFiles(config_files, args.base_path, root_path):
+                print(f"Configuration changed, checking all files ({toml_path}).")
+            else:
+                files = getChangedFiles(
+                    extracted_strings.getReferenceFiles(), args.base_path, root_path
+                )
+                print(f"Changed reference files ({toml_path}): {len(files)}")
 
-    checks = QualityCheck(ref_strings, args.config_file, args.toml_path)
+        extracted_strings.extractStrings(files)
+        checks.runChecks(extracted_strings.getTranslations(), toml_path)
+    if index:
+        index.close()
 
     has_errors = False
     for config_name, config_errors in checks.errors.items():
         if config_errors:
             has_errors = True
     if has_errors:
-        output = outputErrors(checks.errors)
-        print(output)
+        writeErrors(checks.errors, sys.stdout)
+        print()
 
         # Check if there's a JSON output specified
         json_file = args.json_file
         if json_file:
-            print(f"Saving output to {json_file}")
-            if os.path.exists(json_file):
-                try:
-                    with open(json_file, "r") as f:
-                        previous_content = json.load(f)
-                except Exception:
-                    previous_content = {}
-            else:
-                previous_content = {}
-
-            merged_content = mergeErrors(checks.errors, previous_content)
-            with open(json_file, "w") as f:
-                json.dump(merged_content, f, indent=2, sort_keys=True)
+            saveErrors(checks.errors, json_file)
         else:
             # Exit with status 1
             sys.exit(1)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Scripts import their helpers as sibling modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
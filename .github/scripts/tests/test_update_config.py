@@ -0,0 +1,84 @@
+import pytest
+from functions import StringIndex
+from update_config import getExceptions, getStrings
+
+RESOURCE = """<?xml version="1.0" encoding="utf-8"?>
+<resources xmlns:tools="http://schemas.android.com/tools"
+    xmlns:xliff="urn:oasis:names:tc:xliff:document:1.2">
+    {}
+</resources>
+"""
+
+
+@pytest.mark.parametrize(
+    "string, expected",
+    [
+        (
+            '<string name="a" tools:ignore="IncorrectStraightQuote">'
+            "Hello <b>it\\'s</b></string>",
+            [("single_quotes", "q:a")],
+        ),
+        (
+            '<string name="a" tools:ignore="IncorrectStraightDoubleQuote">'
+            '<a href="https://example.com">Link</a></string>',
+            [],
+        ),
+        (
+            '<string name="a" tools:ignore="BrandUsage,PlaceholderComment">'
+            "Firefox %s</string>",
+            [("brand", "q:a"), ("placeables", "q:a")],
+        ),
+        (
+            '<string name="a" tools:ignore="IncorrectStraightDoubleQuote">'
+            '<![CDATA[<a href="https://example.com">Link</a>]]></string>',
+            [],
+        ),
+        (
+            '<string name="a" tools:ignore="IncorrectStraightQuote">'
+            "It\\u0027s</string>",
+            [("single_quotes", "q:a")],
+        ),
+        (
+            '<string name="a" tools:ignore="IncorrectStraightDoubleQuote">'
+            'Open <xliff:g id="name" example="&quot;x&quot;">%s</xliff:g></string>',
+            [],
+        ),
+        (
+            '<string name="a" tools:ignore="IncorrectStraightDoubleQuote">'
+            "Say &quot;hi&quot; &amp; <i>bye</i></string>",
+            [("double_quotes", "q:a")],
+        ),
+    ],
+)
+def test_exceptions_same_with_index(tmp_path, string, expected):
+    file_path = tmp_path / "strings.xml"
+    file_path.write_text(RESOURCE.format(string))
+
+    without_index = getExceptions(str(file_path), "q")
+    index = StringIndex(":memory:")
+    with_index = getExceptions(str(file_path), "q", index)
+    # A second lookup reads the entries stored in the index
+    from_index = getExceptions(str(file_path), "q", index)
+    index.close()
+
+    assert without_index == (expected, None)
+    assert with_index == without_index
+    assert from_index == without_index
+
+
+@pytest.mark.parametrize(
+    "string",
+    [
+        'Hello <b>it\\\'s</b> and \\"this\\"',
+        '<![CDATA[<a href="https://example.com">Link</a>]]>',
+        'Open <xliff:g id="name" example="Firefox">%1$s</xliff:g> &amp; <i>go</i>',
+        "It\\u0027s",
+    ],
+)
+def test_strings_same_with_index(tmp_path, string):
+    file_path = tmp_path / "strings.xml"
+    file_path.write_text(RESOURCE.format(f'<string name="a">{string}</string>'))
+
+    index = StringIndex(":memory:")
+    assert getStrings(str(file_path)) == getStrings(str(file_path), index)
+    index.close()
@@ -6,12 +6,19 @@
 Update the localization source files from an Android-related branch, adding new files and
 messages. For updates from the "{HEAD}" branch, also update changed messages.
 
+With --branches, updates from several branches in a single pass, reading and writing
+each file only once and applying the updates from the "{HEAD}" branch last.
+
 Writes a summary of the branch's localized files and message keys as
 `_data/[project]/[branch].json`, and a commit message summary as `.update_msg`.
+
+The content hashes of the source files are stored as `_data/[project]/[branch].hashes.json`,
+so that files which are unchanged since the previous run can be skipped.
 """
 
 import json
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 from filecmp import cmp
 from os import makedirs, pardir
 from os.path import abspath, dirname, exists, join, relpath
@@ -21,12 +28,12 @@ from typing import TypedDict
 
 from moz.l10n.formats import UnsupportedFormat
 from moz.l10n.paths import L10nConfigPaths
-from moz.l10n.resource import (
-    add_entries,
-    parse_resource,
-    serialize_resource,
-)
-from moz.l10n.model import Entry
+from moz.l10n.resource import add_entries, parse_resource
+from moz.l10n.model import Entry, Resource
+
+from functions import file_hash, write_file, write_resource
+from prune import prune_paths, prune_resource, scan_data
+from prune import write_commit_msg as write_prune_msg
 
 
 class AutomationConfig(TypedDict):
@@ -35,108 +42,284 @@ class AutomationConfig(TypedDict):
     paths: dict[str, str]
 
 
+def update_file(
+    dest_path: str,
+    sources: list[tuple[str, bool]],
+    msg_refs: set[str] | None = None,
+) -> tuple[list[list[str] | None], str | None, int]:
+    """
+    Update `dest_path` from each `(fx_path, is_head)` source file in order,
+    writing it at most once.
+
+    If `msg_refs` is set, also drop any messages that are not in `msg_refs`
+    or in any of the source files.
+
+    Returns the message keys of each source file (`None` if it was not found),
+    "create" or "update" if the destination was changed,
+    and the number of dropped messages.
+    """
+    makedirs(dirname(dest_path), exist_ok=True)
+
+    keys: list[list[str] | None] = []
+    res: Resource | None = None
+    change: str | None = None
+    same_as_source = False
+    for fx_path, is_head in sources:
+        try:
+            fx_res = parse_resource(fx_path)
+        except FileNotFoundError:
+            keys.append(None)
+            continue
+        except UnsupportedFormat:
+            keys.append([])
+            with open(fx_path, "rb") as file:
+                data = file.read()
+            if not exists(dest_path):
+                write_file(dest_path, data)
+                change = "create"
+            elif is_head and write_file(dest_path, data):
+                change = change or "update"
+            continue
+
+        keys.append(
+            [
+                ".".join(section.id + entry.id)
+                for section in fx_res.sections
+                for entry in section.entries
+                if isinstance(entry, Entry)
+            ]
+        )
+
+        if res is None:
+            if not exists(dest_path):
+                res = fx_res
+                change = "create"
+                continue
+            elif cmp(fx_path, dest_path):
+                same_as_source = True
+                continue
+            with open(dest_path, "rb") as file:
+                res = parse_resource(dest_path, file.read())
+        if add_entries(res, fx_res, use_source_entries=is_head):
+            change = change or "update"
+
+    drop_count = 0
+    if msg_refs is not None:
+        msg_refs = msg_refs.union(*(source_keys for source_keys in keys if source_keys))
+        # A destination that is identical to a source file has nothing to drop.
+        if msg_refs and res is None and not same_as_source and exists(dest_path):
+            with open(dest_path, "rb") as file:
+                res = parse_resource(dest_path, file.read())
+        if msg_refs and res is not None:
+            drop_count = prune_resource(res, msg_refs)
+
+    if res is not None and (change or drop_count):
+        if not write_resource(dest_path, res) and change == "update":
+            # The merged entries serialize to the current content.
+            change = None
+    return keys, change, drop_count
+
+
+def load_cache(
+    data_path: str, hashes_path: str
+) -> tuple[dict[str, list[str]], dict[str, str]]:
+    """
+    Load the message keys and source file hashes written by the previous run.
+    """
+    try:
+        with open(data_path) as file:
+            messages = json.load(file)
+        with open(hashes_path) as file:
+            hashes = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}, {}
+    return messages, hashes
+
+
 def update(
     cfg_automation: AutomationConfig,
     project: str,
-    branch: str,
-    fx_root: str,
+    fx_roots: dict[str, str],
     repo_root: str,
-):
-    if branch not in cfg_automation["branches"]:
-        exit(f"Unknown branch: {branch}")
-    is_head = branch == cfg_automation["head"]
-    if not exists(fx_root):
-        exit(f"Firefox root not found: {fx_root}")
-    print(f"source: {branch} at {fx_root}")
-    fx_root = abspath(fx_root)
-
-    source_files: set[str] = set()
+    jobs: int = 1,
+    no_cache: bool = False,
+    prune: bool = False,
+) -> tuple[int, int, tuple[list[str], int, int] | None]:
+    """
+    Update the project's files from one or more branches,
+    with `fx_roots` mapping each branch to the root of its Firefox source tree.
 
-    cfg_path = join(fx_root, cfg_automation["paths"][project], "l10n.toml")
+    Each destination file is read and written at most once,
+    with updates from the "head" branch applied last.
 
-    if not exists(cfg_path):
-        exit(f"Config file not found: {cfg_path}")
+    If `prune` is set, all branches must be included.
+    Files and messages not used by any branch are then removed as each file is updated,
+    as well as any other JSON data files in `_data/[project]/`.
+    The removed data, file count and message count are returned as the third value.
+    """
+    for branch in fx_roots:
+        if branch not in cfg_automation["branches"]:
+            exit(f"Unknown branch: {branch}")
+    if prune and set(fx_roots) != set(cfg_automation["branches"]):
+        exit(
+            f"Pruning requires updates from all branches: {cfg_automation['branches']}"
+        )
+    head = cfg_automation["head"]
+    branches = [
+        branch
+        for branch in cfg_automation["branches"]
+        if branch in fx_roots and branch != head
+    ]
+    if head in fx_roots:
+        branches.append(head)
 
     project_base_path = join(repo_root, "mozilla-mobile")
-    paths = L10nConfigPaths(cfg_path)
-    if branch == cfg_automation["head"]:
-        dest_path = join(project_base_path, project)
-        print(f"\nCopying l10n.toml to {relpath(dest_path, repo_root)}")
-        copy(cfg_path, dest_path)
 
-    messages: dict[str, list[str]] = {}
-    new_files = 0
-    updated_files = 0
+    # rel_path -> (dest_path, branch -> fx_path)
+    files: dict[str, tuple[str, dict[str, str]]] = {}
+    messages: dict[str, dict[str, list[str]]] = {}
+    hashes: dict[str, dict[str, str]] = {}
+    prev_messages: dict[str, dict[str, list[str]]] = {}
+    prev_hashes: dict[str, dict[str, str]] = {}
+    for branch in branches:
+        fx_root = fx_roots[branch]
+        if not exists(fx_root):
+            exit(f"Firefox root not found: {fx_root}")
+        print(f"source: {branch} at {fx_root}")
+        fx_root = abspath(fx_root)
 
-    source_files = (fx_path for fx_path, _ in paths.all())
-    for fx_path in source_files:
-        dest_path = join(
-            project_base_path,
-            relpath(fx_path, fx_root).replace("mobile/android/", ""),
-        )
-        rel_path = relpath(dest_path, repo_root)
+        cfg_path = join(fx_root, cfg_automation["paths"][project], "l10n.toml")
 
-        makedirs(dirname(dest_path), exist_ok=True)
+        if not exists(cfg_path):
+            exit(f"Config file not found: {cfg_path}")
 
-        try:
-            fx_res = parse_resource(fx_path)
-        except FileNotFoundError:
-            print(f"source file not found: {fx_path}")
-            continue
-        except UnsupportedFormat:
-            messages[rel_path] = []
-            if not exists(dest_path):
-                print(f"create {rel_path}")
-                copy(fx_path, dest_path)
-                new_files += 1
-            elif branch == cfg_automation["head"] and not cmp(fx_path, dest_path):
-                print(f"update {rel_path}")
-                copy(fx_path, dest_path)
-                updated_files += 1
+        paths = L10nConfigPaths(cfg_path)
+        if branch == head:
+            dest_path = join(project_base_path, project)
+            print(f"\nCopying l10n.toml to {relpath(dest_path, repo_root)}")
+            copy(cfg_path, dest_path)
+
+        data_path = join(repo_root, "_data", project, f"{branch}.json")
+        hashes_path = join(repo_root, "_data", project, f"{branch}.hashes.json")
+        prev_messages[branch], prev_hashes[branch] = (
+            ({}, {}) if no_cache else load_cache(data_path, hashes_path)
+        )
+        messages[branch] = {}
+        hashes[branch] = {}
+
+        for fx_path, _ in paths.all():
+            dest_path = join(
+                project_base_path,
+                relpath(fx_path, fx_root).replace("mobile/android/", ""),
+            )
+            rel_path = relpath(dest_path, repo_root)
+            if rel_path in files:
+                files[rel_path][1][branch] = fx_path
             else:
-                # print(f"skip {rel_path}")
+                files[rel_path] = (dest_path, {branch: fx_path})
+            try:
+                hashes[branch][rel_path] = file_hash(fx_path)
+            except FileNotFoundError:
                 pass
+
+    new_files = 0
+    updated_files = 0
+
+    removed_messages = 0
+
+    dest_paths: list[str] = []
+    sources: list[list[tuple[str, bool]]] = []
+    source_branches: list[list[str]] = []
+    msg_refs: list[set[str] | None] = []
+    for rel_path, (dest_path, fx_paths) in files.items():
+        # If no source is changed since the last run, their messages have
+        # already been added to the destination file.
+        if exists(dest_path) and all(
+            rel_path in hashes[branch]
+            and prev_hashes[branch].get(rel_path) == hashes[branch][rel_path]
+            and rel_path in prev_messages[branch]
+            for branch in fx_paths
+        ):
+            for branch in fx_paths:
+                messages[branch][rel_path] = prev_messages[branch][rel_path]
+            if prune:
+                # The file may still need pruning, but not updating.
+                dest_paths.append(dest_path)
+                sources.append([])
+                source_branches.append([])
+                msg_refs.append(
+                    set().union(
+                        *(prev_messages[branch][rel_path] for branch in fx_paths)
+                    )
+                )
             continue
+        dest_paths.append(dest_path)
+        sources.append(
+            [(fx_path, branch == head) for branch, fx_path in fx_paths.items()]
+        )
+        source_branches.append(list(fx_paths))
+        msg_refs.append(set() if prune else None)
 
-        messages[rel_path] = [
-            ".".join(section.id + entry.id)
-            for section in fx_res.sections
-            for entry in section.entries
-            if isinstance(entry, Entry)
-        ]
+    if jobs > 1:
+        # Each file is independent, so parsing and merging can be done in
+        # parallel. Results are reported in order once all workers are done.
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(update_file, dest_paths, sources, msg_refs))
+    else:
+        results = map(update_file, dest_paths, sources, msg_refs)
 
-        if not exists(dest_path):
+    for dest_path, file_sources, file_branches, (keys, change, drop_count) in zip(
+        dest_paths, sources, source_branches, results
+    ):
+        rel_path = relpath(dest_path, repo_root)
+        for (fx_path, _), branch, branch_keys in zip(file_sources, file_branches, keys):
+            if branch_keys is None:
+                print(f"source file not found: {fx_path}")
+            else:
+                messages[branch][rel_path] = branch_keys
+        if change == "create":
             print(f"create {rel_path}")
-            with open(dest_path, "+wb") as file:
-                for line in serialize_resource(fx_res):
-                    file.write(line.encode("utf-8"))
             new_files += 1
-        elif cmp(fx_path, dest_path):
-            # print(f"equal {rel_path}")
-            pass
-        else:
-            with open(dest_path, "+rb") as file:
-                res = parse_resource(dest_path, file.read())
-                if add_entries(res, fx_res, use_source_entries=is_head):
-                    print(f"update {rel_path}")
-                    file.seek(0)
-                    for line in serialize_resource(res):
-                        file.write(line.encode("utf-8"))
-                    file.truncate()
-                    updated_files += 1
-                else:
-                    # print(f"unchanged {rel_path}")
-                    pass
-
-    data_path = join(repo_root, "_data", project, f"{branch}.json")
-    makedirs(dirname(data_path), exist_ok=True)
-    with open(data_path, "w") as file:
-        json.dump(messages, file, indent=2, sort_keys=True)
-
-    return new_files, updated_files
-
-
-def write_commit_msg(args, new_files: int, updated_files: int, repo_root: str):
+        elif change == "update":
+            print(f"update {rel_path}")
+            updated_files += 1
+        if drop_count:
+            print(f"drop {drop_count} from {rel_path}")
+            removed_messages += drop_count
+
+    for branch in branches:
+        data_path = join(repo_root, "_data", project, f"{branch}.json")
+        hashes_path = join(repo_root, "_data", project, f"{branch}.hashes.json")
+        makedirs(dirname(data_path), exist_ok=True)
+        with open(data_path, "w") as file:
+            json.dump(messages[branch], file, indent=2, sort_keys=True)
+        with open(hashes_path, "w") as file:
+            branch_hashes = {
+                path: hash
+                for path, hash in hashes[branch].items()
+                if path in messages[branch]
+            }
+            json.dump(branch_hashes, file, indent=2, sort_keys=True)
+
+    if not prune:
+        return new_files, updated_files, None
+
+    refs: dict[str, set[str]] = {}
+    for branch_messages in messages.values():
+        for path, keys in branch_messages.items():
+            refs.setdefault(path, set()).update(keys)
+    removed_data, _ = scan_data(project, cfg_automation["branches"], repo_root)
+    removed_files, _ = prune_paths(project, refs, repo_root, prune_messages=False)
+    return new_files, updated_files, (removed_data, removed_files, removed_messages)
+
+
+def write_commit_msg(
+    branches: list[str],
+    commits: list[str] | None,
+    new_files: int,
+    updated_files: int,
+    repo_root: str,
+):
     new_str = f"{new_files} new" if new_files else ""
     update_str = f"{updated_files} updated" if updated_files else ""
     summary = (
@@ -146,7 +329,10 @@ def write_commit_msg(args, new_files: int, updated_files: int, repo_root: str):
     )
     count = updated_files or new_files
     summary += " files" if count > 1 else " file" if count == 1 else ""
-    head = f"{args.branch} ({args.commit})" if args.commit else args.branch
+    head = ", ".join(
+        f"{branch} ({commit})" if commit else branch
+        for branch, commit in zip(branches, commits or [None] * len(branches))
+    )
     with open(join(repo_root, ".update_msg"), "w") as file:
         file.write(f"{head}: {summary}")
 
@@ -172,19 +358,73 @@ if __name__ == "__main__":
         choices=["fenix", "android-components", "focus-android"],
         help='The project identifier, e.g. "fenix", "android-components", or "focus-android".',
     )
-    parser.add_argument(
+    branch_group = parser.add_mutually_exclusive_group(required=True)
+    branch_group.add_argument(
         "--branch",
-        required=True,
         help='The branch identifier, e.g. "main", "beta", or "release".',
     )
-    parser.add_argument("--commit", help="A commit id for the branch.")
+    branch_group.add_argument(
+        "--branches",
+        help='Comma-separated branch identifiers, e.g. "release,beta,main", '
+        "to update from all of them in a single pass.",
+    )
     parser.add_argument(
-        "--firefox", required=True, help="Path to the root of the Firefox source tree."
+        "--commit",
+        help="A commit id for the branch, or comma-separated ids for --branches.",
+    )
+    firefox_group = parser.add_mutually_exclusive_group(required=True)
+    firefox_group.add_argument(
+        "--firefox", help="Path to the root of the Firefox source tree."
+    )
+    firefox_group.add_argument(
+        "--firefox-roots",
+        help="Comma-separated paths to the Firefox source trees for --branches.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes used to update files (default: 1).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Process all source files, even if unchanged since the previous run.",
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="With --branches including all branches, also remove files and messages "
+        "not used by any branch, and write a summary as `.prune_msg`.",
     )
     args = parser.parse_args()
 
-    new_files, updated_files = update(
-        cfg_automation, args.project, args.branch, args.firefox, repo_root
+    if args.branch:
+        if not args.firefox:
+            parser.error("--branch requires --firefox")
+        branches = [args.branch]
+        fx_roots = [args.firefox]
+    else:
+        if not args.firefox_roots:
+            parser.error("--branches requires --firefox-roots")
+        branches = args.branches.split(",")
+        fx_roots = args.firefox_roots.split(",")
+        if len(fx_roots) != len(branches):
+            parser.error("--firefox-roots must have one path for each branch")
+    commits = args.commit.split(",") if args.commit else None
+    if commits and len(commits) != len(branches):
+        parser.error("--commit must have one id for each branch")
+
+    new_files, updated_files, removed = update(
+        cfg_automation,
+        args.project,
+        dict(zip(branches, fx_roots)),
+        repo_root,
+        args.jobs,
+        args.no_cache,
+        args.prune,
     )
 
-    write_commit_msg(args, new_files, updated_files, repo_root)
+    write_commit_msg(branches, commits, new_files, updated_files, repo_root)
+    if removed:
+        write_prune_msg(*removed, repo_root)
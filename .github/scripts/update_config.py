@@ -4,14 +4,42 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+from concurrent.futures import ProcessPoolExecutor
 from moz.l10n.paths import L10nConfigPaths, get_android_locale
-from functions import strip_html
+from functions import (
+    TOOLS_IGNORE,
+    ExceptionIndex,
+    StringIndex,
+    file_hash,
+    get_entries,
+    strip_html,
+    write_file,
+)
+from hashlib import sha256
+from xml.sax.saxutils import escape
 import argparse
 import json
 import os
+import re
 import sys
 import xml.etree.ElementTree as ET
 
+# Android lint rules that can be ignored via tools:ignore, and the matching
+# exception category in the linter config
+XML_LINT = {
+    # "IncorrectEllipsisCharacter": "",
+    "IncorrectStraightQuote": "single_quotes",
+    "IncorrectStraightDoubleQuote": "double_quotes",
+    "BrandUsage": "brand",
+    "PlaceholderComment": "placeables",
+}
+
+REPO_ROOT = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+)
+UNICODE_ESCAPE = re.compile(r"\\u([0-9a-fA-F]{4})")
+ET.register_namespace("xliff", "urn:oasis:names:tc:xliff:document:1.2")
+
 
 def getReferenceFilesToml(toml_path, reference_locale):
     """Extract list of reference files from project configuration (TOML)"""
@@ -33,6 +61,79 @@ def getReferenceFilesToml(toml_path, reference_locale):
     return reference_files
 
 
+def getText(element):
+    """
+    Return the content of a <string> element with its markup, like the value
+    returned by get_entries(): text is XML escaped, and Android escapes for
+    quotes and Unicode characters are resolved.
+    """
+
+    text = escape(element.text or "") + "".join(
+        ET.tostring(child, encoding="unicode") for child in element
+    )
+    text = UNICODE_ESCAPE.sub(lambda m: escape(chr(int(m[1], 16))), text)
+
+    return text.replace('\\"', '"').replace("\\'", "'")
+
+
+def getStrings(file_path, index=None):
+    """
+    Return name, tools:ignore value and text for each <string> in a reference
+    file. The text includes markup, so the same exceptions are found whether
+    or not an index is used.
+    """
+
+    if index:
+        return [
+            (entry["id"], entry["ignore"], entry["value"])
+            for entry in get_entries(file_path, index)
+            if entry["kind"] == "string"
+        ]
+
+    # Scan top-level elements as they're parsed, and clear them once read to
+    # avoid keeping the whole document in memory
+    strings = []
+    depth = 0
+    root = None
+    for event, element in ET.iterparse(file_path, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            if element.tag == "string":
+                strings.append(
+                    (
+                        element.attrib["name"],
+                        element.attrib.get(TOOLS_IGNORE, ""),
+                        getText(element),
+                    )
+                )
+            root.clear()
+
+    return strings
+
+
+def load_cache(cache_file, config_file):
+    """
+    Load the hashes of the reference files scanned by previous runs. They're
+    only valid if the config file wasn't changed since, e.g. by editing its
+    exceptions manually.
+    """
+
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get("config") != file_hash(config_file):
+        return {}
+
+    return cache
+
+
 def check_string_quotes(text, rule):
     quote = "'" if rule == "IncorrectStraightQuote" else '"'
     cleaned_text = strip_html(text)
@@ -42,6 +143,36 @@ def check_string_quotes(text, rule):
     return False
 
 
+def getExceptions(file_path, rel_path, index=None):
+    """
+    Return the exceptions defined via tools:ignore in a reference file, as
+    (category, string ID) tuples, and an error message if the file can't be
+    read.
+    """
+
+    exceptions = []
+    try:
+        for name, ignore, text in getStrings(file_path, index):
+            string_id = f"{rel_path}:{name}"
+            tools_ignore = [
+                rule.strip()
+                for rule in ignore.split(",")
+                if rule.strip() in XML_LINT.keys()
+            ]
+            for rule in tools_ignore:
+                # For quotes, skip if it's just HTML markup
+                if "Quote" in rule and not check_string_quotes(text, rule):
+                    continue
+                exceptions.append((XML_LINT[rule], string_id))
+    except SyntaxError as e:
+        # XML parsing errors
+        return exceptions, f"Error parsing XML file: {e}"
+    except Exception as e:
+        return exceptions, f"Unexpected error: {e}"
+
+    return exceptions, None
+
+
 def main():
     # Read command line input parameters
     cl_parser = argparse.ArgumentParser()
@@ -64,6 +195,30 @@ def main():
         dest="config_file",
         help="Path to JSON file with extra config (exceptions, brand names, etc.)",
     )
+    cl_parser.add_argument(
+        "--index",
+        dest="index_file",
+        help="Path to SQLite file used to store and reuse parsed strings",
+    )
+    cl_parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes used to scan files (default: 1, "
+        "ignored with --index)",
+    )
+    cl_parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        dest="no_cache",
+        help="Scan all reference files, even if unchanged since the previous run",
+    )
+    cl_parser.add_argument(
+        "--cache",
+        dest="cache_file",
+        help="Path to JSON file storing the hashes of scanned reference files "
+        "(default: _data/[config].hashes.json)",
+    )
     args = cl_parser.parse_args()
 
     config_file = args.config_file
@@ -77,14 +232,7 @@ def main():
             sys.exit(e)
 
     ref_files = getReferenceFilesToml(args.toml_path, args.reference_locale)
-    xml_lint = {
-        # "IncorrectEllipsisCharacter": "",
-        "IncorrectStraightQuote": "single_quotes",
-        "IncorrectStraightDoubleQuote": "double_quotes",
-        "BrandUsage": "brand",
-        "PlaceholderComment": "placeables",
-    }
-    managed_categories = set(xml_lint.values())
+    managed_categories = set(XML_LINT.values())
 
     # Reference files covered by this TOML run. The same config file is shared
     # across projects (e.g. firefox.toml and focus.toml), so only entries whose
@@ -92,46 +240,93 @@ def main():
     # preserved.
     managed_paths = {ref_file["rel_path"] for ref_file in ref_files}
 
-    # Collect the exceptions currently expressed via tools:ignore in this run's
-    # reference files.
-    current = {category: set() for category in managed_categories}
+    # Content hashes of the reference files scanned by previous runs. Each
+    # exception starts with the path of the file it comes from, so files that
+    # didn't change keep their exceptions without being scanned. The hashes are
+    # committed with the config file, so that the next run in CI can use them.
+    cache_file = args.cache_file or os.path.join(
+        REPO_ROOT,
+        "_data",
+        f"{os.path.splitext(os.path.basename(config_file))[0]}.hashes.json",
+    )
+    cache = {} if args.no_cache else load_cache(cache_file, config_file)
+    prev_hashes = cache.get("sources", {})
+    hashes = {}
+    scan_files = []
     for ref_file in ref_files:
+        rel_path = ref_file["rel_path"]
         try:
-            tree = ET.parse(ref_file["abs_path"])
-            root = tree.getroot()
-            for string in root.findall("string"):
-                string_id = f"{ref_file['rel_path']}:{string.attrib['name']}"
-                tools_ignore = [
-                    rule.strip()
-                    for rule in string.attrib.get(
-                        "{http://schemas.android.com/tools}ignore", ""
-                    ).split(",")
-                    if rule.strip() in xml_lint.keys()
-                ]
-                for rule in tools_ignore:
-                    # For quotes, skip if it's just HTML markup
-                    if "Quote" in rule and not check_string_quotes(string.text, rule):
-                        continue
-                    current[xml_lint[rule]].add(string_id)
-        except ET.ParseError as e:
-            print(f"Error parsing XML file: {e}")
-        except Exception as e:
-            print(f"Unexpected error: {e}")
+            hashes[rel_path] = file_hash(ref_file["abs_path"])
+        except OSError:
+            scan_files.append(ref_file)
+            continue
+        if hashes[rel_path] != prev_hashes.get(rel_path):
+            scan_files.append(ref_file)
+    print(f"Scanning {len(scan_files)} of {len(ref_files)} reference files.")
+
+    # Collect the exceptions currently expressed via tools:ignore in the
+    # changed reference files.
+    current = {category: set() for category in managed_categories}
+    abs_paths = [ref_file["abs_path"] for ref_file in scan_files]
+    rel_paths = [ref_file["rel_path"] for ref_file in scan_files]
+    if args.index_file:
+        index = StringIndex(args.index_file)
+        results = [
+            getExceptions(abs_path, rel_path, index)
+            for abs_path, rel_path in zip(abs_paths, rel_paths)
+        ]
+        index.close()
+    elif args.jobs > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            results = list(executor.map(getExceptions, abs_paths, rel_paths))
+    else:
+        results = map(getExceptions, abs_paths, rel_paths)
+    for rel_path, (exceptions, error) in zip(rel_paths, results):
+        if error:
+            print(error)
+            # Scan the file again in the next run
+            hashes.pop(rel_path, None)
+        for category, string_id in exceptions:
+            current[category].add(string_id)
 
-    # Rebuild each managed list: keep entries outside this run's scope (other
-    # projects), replace in-scope entries with the new ones so obsolete strings
-    # are dropped, then sort.
+    # Patch each managed list: replace the entries of the scanned files with
+    # the new ones so obsolete strings are dropped, and keep everything else
+    # (other files and projects, wildcard patterns). IDs already covered by a
+    # pattern are not added again.
+    scanned_paths = set(rel_paths)
     for category in managed_categories:
         existing = config["exceptions"].get(category, [])
-        out_of_scope = [
+        kept = [
             string_id
             for string_id in existing
-            if string_id.split(":", 1)[0] not in managed_paths
+            if ExceptionIndex.is_pattern(string_id)
+            or string_id.split(":", 1)[0] not in scanned_paths
         ]
-        config["exceptions"][category] = sorted(set(out_of_scope) | current[category])
+        patterns = ExceptionIndex(
+            {category: [e for e in kept if ExceptionIndex.is_pattern(e)]}
+        )
+        new_ids = {
+            string_id
+            for string_id in current[category]
+            if not patterns.matches(category, string_id)
+        }
+        config["exceptions"][category] = sorted(set(kept) | new_ids)
 
-    with open(config_file, "w") as f:
-        json.dump(config, f, indent=4, sort_keys=True)
+    content = json.dumps(config, indent=4, sort_keys=True).encode("utf-8")
+    if write_file(config_file, content):
+        print(f"Updated {config_file}.")
+    else:
+        print(f"No changes to {config_file}.")
+
+    # Store hashes of the scanned files, keeping those of other projects
+    sources = {
+        rel_path: source_hash
+        for rel_path, source_hash in prev_hashes.items()
+        if rel_path not in managed_paths
+    }
+    sources.update(hashes)
+    cache = {"config": sha256(content).hexdigest(), "sources": sources}
+    write_file(cache_file, json.dumps(cache, indent=2, sort_keys=True).encode("utf-8"))
 
 
 if __name__ == "__main__":